@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+消息热路径微基准测试
+逐个测量每条消息都会经过的组件：命令解析、帧编解码、JSON编解码、User.to_dict、
+用户列表格式化，以及基于内存 SQLite 的 DatabaseManager CRUD。
+
+每项先预热，再重复测量多轮（每轮运行到至少 --min-time 秒），取最快一轮的 ops/sec 并给出各轮波动；
+与保存的基线比较，任一项下降超过 --threshold 时以退出码1结束，基线文件不存在时以退出码2结束（不做测量），可直接用于CI。
+
+用法:
+    python benchmark_hot_path.py --save-baseline     # 运行并保存基线
+    python benchmark_hot_path.py                     # 运行并与基线比较
+    python benchmark_hot_path.py -k db. --repeats 9  # 只运行名称包含 db. 的项
+"""
+
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from client import SecureClientSocket
+from command_parser import parse_command
+from database_models import DatabaseManager, User, UserRecord
+from server import SecureReceivedSocket, Server, format_user_lines
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+
+COMMANDS = [
+    'add 1 2',
+    'user_get alice',
+    'user_update 42 full_name "Alice \\"Al\\" Smith" age 31',
+    "user_create bob bob@example.com secret 'Bob Stone' 28 'likes long walks on the beach'",
+]
+
+
+def make_user(i: int) -> User:
+    now = datetime.now()
+    return User(id=i, username=f'user{i}', email=f'user{i}@example.com', password='secret',
+                full_name=f'User Number {i}', age=20 + i % 50, created_at=now, updated_at=now,
+                description='这是一个用于基准测试的用户描述')
+
+
+def make_record(i: int) -> UserRecord:
+    now = datetime.now()
+    return UserRecord(i, f'user{i}', f'user{i}@example.com', f'User Number {i}', 20 + i % 50, now, now,
+                      '这是一个用于基准测试的用户描述')
+
+
+def bench_parse_command():
+    def run():
+        for command in COMMANDS:
+            parse_command(command)
+    return run, len(COMMANDS)
+
+
+def framing_pair():
+    """用 socketpair 连接服务器端和客户端的帧编解码（不含TLS，只测帧格式本身）"""
+    server_side, client_side = socket.socketpair()
+    received = SecureReceivedSocket(server_side)
+    client = SecureClientSocket()
+    client.sock.close()
+    client.tls_sock = client_side
+    return received, client
+
+
+def bench_framing(received, client):
+    packet = json.dumps({'id': 'abcd1234', 'content': 'user_get alice', 'timestamp': time.time()})
+    reply = json.dumps({'id': 'abcd1234', 'content': '用户信息 - ID: 1\n  用户名: alice\n' * 4})
+
+    def run():
+        client.send(packet)
+        received.recv()
+        received.send(reply)
+        client.recv()
+    return run, 1
+
+
+def bench_json():
+    packet = {'id': 'abcd1234', 'content': 'user_get alice', 'timestamp': time.time(), 'trace_id': 'f00d'}
+    data = json.dumps(packet)
+
+    def run():
+        json.loads(data)
+        json.dumps(packet)
+    return run, 1
+
+
+def bench_user_to_dict():
+    users = [make_user(i) for i in range(100)]
+
+    def run():
+        for user in users:
+            user.to_dict()
+    return run, len(users)
+
+
+def bench_record_to_dict():
+    records = [make_record(i) for i in range(100)]
+
+    def run():
+        for record in records:
+            record.to_dict()
+    return run, len(records)
+
+
+def bench_format_users():
+    records = [make_record(i) for i in range(1000)]
+
+    def run():
+        format_user_lines(records)
+    return run, len(records)
+
+
+def bench_response_user_list(manager):
+    """get_response_message 查询并格式化全部用户（1000行）"""
+    # 只需要 get_response_message 用到的属性，不启动监听套接字
+    server = Server.__new__(Server)
+    server.db_manager = manager
+    server.tracer = None
+
+    def run():
+        server.get_response_message('bench', 'user_get')
+    return run, 1
+
+
+def bench_db(manager):
+    counter = itertools.count()
+    user_ids = []
+
+    def create_delete():
+        i = next(counter)
+        result = manager.create_user(f'tmp{i}', f'tmp{i}@example.com', 'secret', 'Temp User', 30)
+        manager.delete_user(result['data']['id'])
+
+    def get_by_id():
+        manager.get_user(user_id=user_ids[0])
+
+    def get_by_username():
+        manager.get_user(username='user500')
+
+    def update():
+        manager.update_user(user_ids[1], age=next(counter) % 80)
+
+    user_ids.extend([manager.get_user(username='user1')['data']['id'], manager.get_user(username='user2')['data']['id']])
+    return {
+        'db.create_delete': (create_delete, 1),
+        'db.get_by_id': (get_by_id, 1),
+        'db.get_by_username': (get_by_username, 1),
+        'db.update': (update, 1),
+    }
+
+
+def measure(func, ops_per_call: int, warmup: float, min_time: float, repeats: int) -> dict:
+    # 预热，同时估算每轮需要的调用次数
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < warmup or calls == 0:
+        func()
+        calls += 1
+    per_call = (time.perf_counter() - start) / calls
+    loops = max(1, int(min_time / per_call))
+
+    # 与 timeit 相同，测量期间关闭垃圾回收，减少各轮之间的波动
+    rates = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            rates.append(loops * ops_per_call / (time.perf_counter() - start))
+    finally:
+        gc.enable()
+    # 与 timeit 的建议一致，以最快一轮作为结果：更慢的轮次多半是受到其他进程干扰，而不是代码本身的波动
+    median = statistics.median(rates)
+    return {
+        'ops_per_sec': max(rates),
+        'median': median,
+        'spread': (max(rates) - min(rates)) / median,  # 各轮之间的相对波动
+    }
+
+
+def build_benchmarks(manager, received, client) -> dict:
+    benchmarks = {
+        'parse_command': bench_parse_command(),
+        'framing.roundtrip': bench_framing(received, client),
+        'json.packet': bench_json(),
+        'User.to_dict': bench_user_to_dict(),
+        'UserRecord.to_dict': bench_record_to_dict(),
+        'format_user_lines.1000': bench_format_users(),
+        'response.user_get_all.1000': bench_response_user_list(manager),
+    }
+    benchmarks.update(bench_db(manager))
+    return benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息热路径微基准测试')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的吞吐下降比例，默认0.2（20%%）')
+    parser.add_argument('--repeats', type=int, default=7, help='测量轮数')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每轮最少运行秒数')
+    parser.add_argument('--warmup', type=float, default=0.2, help='预热秒数')
+    parser.add_argument('-k', dest='keyword', help='只运行名称包含该关键字的项')
+    args = parser.parse_args()
+
+    # 比较模式必须有基线，否则CI会在没有做任何比较的情况下通过
+    baseline = {}
+    if not args.save_baseline:
+        if not os.path.exists(args.baseline):
+            print(f"未找到基线 {args.baseline}，先使用 --save-baseline 保存基线")
+            sys.exit(2)
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    # 内存 SQLite 上的数据库管理器，预置1000个用户
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        manager = DatabaseManager('sqlite://')
+        for i in range(1000):
+            manager.create_user(f'user{i}', f'user{i}@example.com', 'secret', f'User Number {i}', 20 + i % 50)
+    received, client = framing_pair()
+    benchmarks = build_benchmarks(manager, received, client)
+
+    results = {}
+    for name, (func, ops_per_call) in benchmarks.items():
+        if args.keyword and args.keyword not in name:
+            continue
+        # DatabaseManager 和服务器会打印日志，测量期间屏蔽输出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = measure(func, ops_per_call, args.warmup, args.min_time, args.repeats)
+
+    regressions = []
+    print(f"{'项目':<28} {'ops/sec':>14} {'波动':>6} {'基线':>12} {'变化':>6}")
+    for name, result in results.items():
+        line = f"{name:<30} {result['ops_per_sec']:>14,.0f} {result['spread']:>8.1%}"
+        if name in baseline:
+            change = result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1
+            line += f" {baseline[name]['ops_per_sec']:>14,.0f} {change:>+8.1%}"
+            if change < -args.threshold:
+                line += "  <-- 性能回退"
+                regressions.append(name)
+        print(line)
+
+    received.close()
+    client.tls_sock.close()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'saved_at': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} 项吞吐下降超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
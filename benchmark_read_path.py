@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户读取路径基准测试
+对比 ORM 路径（query(User) + User.to_dict）与轻量记录路径（列查询 + UserRecord）的
+每秒行数和每行内存占用
+
+用法: python benchmark_read_path.py [行数] [重复次数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database_models import Base, User, UserRecord, _RECORD_COLUMNS
+
+
+def orm_path(session):
+    """原读取路径：构建ORM对象后逐个转换为字典"""
+    return [user.to_dict() for user in session.query(User).all()]
+
+
+def record_path(session):
+    """轻量读取路径：只查询列，直接构造 UserRecord"""
+    return [UserRecord(*row) for row in session.query(*_RECORD_COLUMNS)]
+
+
+def measure(name, func, session_factory, rows, repeats):
+    # 预热
+    session = session_factory()
+    func(session)
+    session.close()
+
+    best = float('inf')
+    for _ in range(repeats):
+        session = session_factory()
+        start = time.perf_counter()
+        result = func(session)
+        best = min(best, time.perf_counter() - start)
+        session.close()
+        assert len(result) == rows
+
+    session = session_factory()
+    tracemalloc.start()
+    result = func(session)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.close()
+    del result
+
+    print(f"{name:<10} {rows / best:>14,.0f} 行/秒 {best * 1000:>10.1f} ms "
+          f"{current / rows:>10.0f} B/行(结果) {peak / rows:>10.0f} B/行(峰值)")
+    return rows / best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        now = datetime.now()
+        with engine.begin() as conn:
+            conn.execute(insert(User), [{
+                'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'secret',
+                'full_name': f'User Number {i}', 'age': 20 + i % 50, 'created_at': now, 'updated_at': now,
+                'description': '这是一个用于基准测试的用户描述' * 4,
+            } for i in range(rows)])
+        session_factory = sessionmaker(bind=engine)
+
+        print(f"读取 {rows} 行，取 {repeats} 次中的最快值")
+        orm_rate = measure('ORM', orm_path, session_factory, rows, repeats)
+        record_rate = measure('UserRecord', record_path, session_factory, rows, repeats)
+        print(f"UserRecord 路径吞吐为 ORM 路径的 {record_rate / orm_rate:.2f} 倍")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库后端基准测试
+用接近线上的命令组合（按ID/用户名查询、搜索、统计、创建、更新、删除）从多个线程并发调用
+DatabaseManager，对比嵌入式SQLite模式（WAL + 调优参数）与MariaDB的吞吐和各操作延迟。
+
+用法: python benchmark_sqlite_mode.py [MariaDB连接串] [线程数] [每线程操作数]
+不传 MariaDB 连接串时只测SQLite。MariaDB 请使用专门的测试库：测试会在 users 表中
+写入 bench_ 前缀的用户，结束时删除。
+"""
+
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from database_models import DatabaseManager
+
+# (操作, 权重)
+COMMAND_MIX = [
+    ('get_by_id', 40),
+    ('get_by_username', 20),
+    ('search', 10),
+    ('count', 5),
+    ('create', 10),
+    ('update', 10),
+    ('delete', 5),
+]
+SEED_USERS = 2000
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run_mix(manager, threads: int, ops_per_thread: int) -> tuple[float, dict]:
+    ids = [manager.get_user(username=f'bench_seed{i}')['data']['id'] for i in range(0, SEED_USERS, 7)]
+    created = []
+    created_lock = threading.Lock()
+    latencies = {name: [] for name, _ in COMMAND_MIX}
+    errors = {name: 0 for name, _ in COMMAND_MIX}
+    names = [name for name, _ in COMMAND_MIX]
+    weights = [weight for _, weight in COMMAND_MIX]
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        for i in range(ops_per_thread):
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            if name == 'get_by_id':
+                result = manager.get_user(user_id=rng.choice(ids))
+            elif name == 'get_by_username':
+                result = manager.get_user(username=f'bench_seed{rng.randrange(SEED_USERS)}')
+            elif name == 'search':
+                result = manager.search_users(f'bench_seed{rng.randrange(10)}', 20)
+            elif name == 'count':
+                result = manager.count_users()
+            elif name == 'create':
+                result = manager.create_user(f'bench_{worker_id}_{i}', f'bench_{worker_id}_{i}@example.com',
+                                             'secret', 'Bench User', 30, '基准测试用户')
+                if result['success']:
+                    with created_lock:
+                        created.append(result['data']['id'])
+            elif name == 'update':
+                result = manager.update_user(rng.choice(ids), age=rng.randrange(18, 80))
+            else:
+                with created_lock:
+                    user_id = created.pop() if created else None
+                if user_id is None:
+                    continue
+                result = manager.delete_user(user_id)
+            latencies[name].append(time.perf_counter() - start)
+            if not result['success']:
+                errors[name] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for user_id in created:
+        manager.delete_user(user_id)
+    total = sum(len(values) for values in latencies.values())
+    return total / elapsed, {name: (latencies[name], errors[name]) for name in names}
+
+
+def seed(manager):
+    for i in range(SEED_USERS):
+        if not manager.get_user(username=f'bench_seed{i}')['success']:
+            manager.create_user(f'bench_seed{i}', f'bench_seed{i}@example.com', 'secret',
+                                f'Seed User {i}', 20 + i % 50, '基准测试种子用户')
+
+
+def cleanup_seed(manager):
+    for i in range(SEED_USERS):
+        result = manager.get_user(username=f'bench_seed{i}')
+        if result['success']:
+            manager.delete_user(result['data']['id'])
+
+
+def bench(name, connection_string, threads, ops_per_thread, cleanup=False):
+    # DatabaseManager 会打印连接和错误日志，测量期间屏蔽输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        manager = DatabaseManager(connection_string)
+        seed(manager)
+        throughput, results = run_mix(manager, threads, ops_per_thread)
+        if cleanup:
+            cleanup_seed(manager)
+        manager.engine.dispose()
+
+    print(f"\n[{name}] {threads} 线程 x {ops_per_thread} 次操作: {throughput:,.0f} 操作/秒")
+    print(f"  {'操作':<16} {'次数':>6} {'p50(ms)':>9} {'p99(ms)':>9} {'失败':>6}")
+    for op, (latencies, errors) in results.items():
+        print(f"  {op:<18} {len(latencies):>8} {percentile(latencies, 0.5) * 1000:>9.2f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.2f} {errors:>8}")
+    return throughput
+
+
+def main():
+    mariadb_url = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != '-' else None
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    ops_per_thread = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_rate = bench('SQLite (WAL)', f"sqlite:///{os.path.join(tmp, 'bench.db')}", threads, ops_per_thread)
+    if mariadb_url:
+        mariadb_rate = bench('MariaDB', mariadb_url, threads, ops_per_thread, cleanup=True)
+        print(f"\nSQLite 吞吐为 MariaDB 的 {sqlite_rate / mariadb_rate:.2f} 倍")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+传输层基准测试
+在本进程内启动服务器，分别通过 TLS 回环连接和 Unix 域套接字发送 add 命令，
+对比逐条请求的延迟（p50/p99）和流水线发送时的吞吐；
+再把 add + user_count 成批连续发出（每批等全部回复后再发下一批），
+分别在 coalesce_delay=0 和 2ms 下观察服务器写合并（平均每次写出的帧数）
+
+用法: python benchmark_transport.py [请求数] [流水线并发数]
+"""
+
+import os
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+import database_models
+from client import Client
+from server import Server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PORT = 18543
+
+
+def make_client(unix_socket_path=None):
+    client = Client(heartbeat_interval=0, unix_socket_path=unix_socket_path)
+    if unix_socket_path:
+        client.socket.connect()
+    else:
+        # 回环连接使用的是正式域名证书，这里只测性能，关闭主机名和证书校验
+        client.socket.context.check_hostname = False
+        client.socket.context.verify_mode = ssl.CERT_NONE
+        client.socket.connect('127.0.0.1', PORT)
+    threading.Thread(target=client.handle_responses, daemon=True).start()
+    return client
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(client, requests, concurrency):
+    # 预热
+    for _ in range(100):
+        client.send_message('add 1 2', timeout=5)
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.send_message('add 1 2', timeout=5)
+        latencies.append(time.perf_counter() - start)
+
+    throughput = pipeline(client, ['add 1 2'], requests, concurrency)
+    return percentile(latencies, 0.5), percentile(latencies, 0.99), throughput
+
+
+def pipeline(client, commands, requests, concurrency) -> float:
+    """流水线：同时保持 concurrency 个请求在途，依次循环发送 commands，返回每秒请求数"""
+    done = threading.Semaphore(0)
+    window = threading.Semaphore(concurrency)
+
+    def on_reply(*_):
+        window.release()
+        done.release()
+
+    start = time.perf_counter()
+    for i in range(requests):
+        window.acquire()
+        client.send_message(commands[i % len(commands)], callback=on_reply, wait_for_reply=False, timeout=5)
+    for _ in range(requests):
+        done.acquire()
+    return requests / (time.perf_counter() - start)
+
+
+def burst(client, commands, requests, size) -> float:
+    """成批发送：每批连续发出 size 个请求（依次循环 commands），收齐回复后再发下一批，返回每秒请求数"""
+    done = threading.Semaphore(0)
+    start = time.perf_counter()
+    for sent in range(0, requests, size):
+        count = min(size, requests - sent)
+        for i in range(count):
+            client.send_message(commands[i % len(commands)], callback=lambda *_: done.release(),
+                                wait_for_reply=False, timeout=5)
+        for _ in range(count):
+            done.acquire()
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_models.get_db_manager(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        unix_socket_path = os.path.join(tmp, 'server.sock')
+        server = Server(hostname='127.0.0.1', port=PORT,
+                        certfile=os.path.join(BASE_DIR, 'fullchain.crt'),
+                        keyfile=os.path.join(BASE_DIR, 'dreamcloud.top.pem'),
+                        unix_socket_path=unix_socket_path)
+
+        # 服务器会逐条打印收发日志，测量期间把标准输出重定向掉
+        stdout = sys.stdout
+        results = {}
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            try:
+                threading.Thread(target=server.service_thread, daemon=True).start()
+                time.sleep(0.2)
+                for name, path in (('TLS', None), ('UDS', unix_socket_path)):
+                    client = make_client(path)
+                    results[name] = measure(client, requests, concurrency)
+                    client.running = False
+                    client.socket.close()
+
+                # 成批的混合请求：内存命令由读线程在同一批中处理，数据库命令的回复在工作线程中暂存合并
+                mixed = {}
+                for delay in (0.0, 0.002):
+                    server.coalesce_delay = delay  # 只影响之后建立的连接
+                    client = make_client()
+                    before = server.get_stats()
+                    rate = burst(client, ['add 1 2', 'user_count'], requests, concurrency)
+                    time.sleep(0.1)  # 等最后一次写出的统计
+                    after = server.get_stats()
+                    mixed[delay] = (rate, after['writes'] - before['writes'],
+                                    after['frames_written'] - before['frames_written'])
+                    client.running = False
+                    client.socket.close()
+            finally:
+                sys.stdout = stdout
+
+        print(f"{requests} 次 add 请求，流水线并发 {concurrency}")
+        for name, (p50, p99, throughput) in results.items():
+            print(f"{name:<4} p50 {p50 * 1e6:>8.0f} us  p99 {p99 * 1e6:>8.0f} us  流水线 {throughput:>10,.0f} 请求/秒")
+        print(f"UDS 流水线吞吐为 TLS 的 {results['UDS'][2] / results['TLS'][2]:.2f} 倍")
+        for delay, (rate, writes, frames) in mixed.items():
+            print(f"TLS 成批混合请求 (add + user_count，每批 {concurrency}) coalesce_delay={delay * 1000:.0f}ms: "
+                  f"{rate:,.0f} 请求/秒，写出 {writes} 次 {frames} 帧，平均每次 {frames / max(writes, 1):.2f} 帧")
+
+
+if __name__ == '__main__':
+    main()
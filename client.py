@@ -4,6 +4,8 @@
 # @Author  : Kevin Chang
 # @File    : client.py
 # @Software: PyCharm
+import collections
+import heapq
 import json
 import os
 import queue
@@ -16,10 +18,14 @@ import uuid
 
 
 class SecureClientSocket:
-    def __init__(self, ca_cert_path=None):
+    def __init__(self, ca_cert_path=None, tcp_nodelay: bool = True):
         # 创建一个普通的 TCP 套接字
         self.tls_sock = None
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_nodelay = tcp_nodelay  # 关闭Nagle算法，小请求立即发出
+        self.sock = self.create_socket(tcp_nodelay)
+        self.hostname = None
+        self.port = None
+        self.session = None  # 上一次连接的TLS会话，重连时复用以跳过完整握手
         # 包装套接字以使用 TLS
         if ca_cert_path and os.path.exists(ca_cert_path):
             # 只信任指定CA颁发的证书
@@ -30,42 +36,197 @@ class SecureClientSocket:
             if ca_cert_path:
                 print(f"Warning: CA certificate file {ca_cert_path} not found, using system defaults")
 
-    def connect(self, hostname: str, port: int):
-        # 创建套接字
-        self.tls_sock = self.context.wrap_socket(self.sock, server_hostname=hostname)
+    @staticmethod
+    def create_socket(tcp_nodelay: bool = True) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 开启TCP keepalive，由内核探测对端是否存活
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if tcp_nodelay else 0)
+        return sock
+
+    def connect(self, hostname: str, port: int, timeout: float = None):
+        self.hostname, self.port = hostname, port
+        # 创建套接字（有上一次的TLS会话时尝试会话复用）
+        self.tls_sock = self.context.wrap_socket(self.sock, server_hostname=hostname, session=self.session)
         # 连接
+        self.tls_sock.settimeout(timeout)
         self.tls_sock.connect((hostname, port))
+        self.tls_sock.settimeout(None)
+
+    def reconnect(self, timeout: float = 5.0):
+        """关闭旧连接并重新连接到同一服务器，复用上一次的TLS会话"""
+        self.close()
+        self.sock = self.create_socket(self.tcp_nodelay)
+        self.connect(self.hostname, self.port, timeout)
+
+    @property
+    def session_reused(self) -> bool:
+        return bool(self.tls_sock and self.tls_sock.session_reused)
 
     def close(self):
-        # 关闭
+        # 关闭（先保存TLS会话，供重连时复用）
         if self.tls_sock:
+            # 必须在 shutdown 之前保存：shutdown 会释放SSL对象，之后取到的会话为空，重连只能完整握手
+            try:
+                self.session = self.tls_sock.session or self.session
+            except (ssl.SSLError, ValueError):
+                pass
+            self.shutdown()
             self.tls_sock.close()
 
+    def shutdown(self):
+        """关闭连接的读写两端：close() 不会唤醒阻塞在 recv 中的线程，shutdown 会让它立即读到连接关闭"""
+        try:
+            self.tls_sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # 连接已断开或已关闭
+
     def send(self, data: str):
         # 发送数据
         if self.tls_sock:
-            self.tls_sock.sendall(len(data).to_bytes(4, 'big') + data.encode())
+            payload = data.encode()
+            self.tls_sock.sendall(len(payload).to_bytes(4, 'big') + payload)
+
+    def recv_exact(self, size: int) -> bytes:
+        """读满 size 字节（一次 recv 可能只返回一部分），对端关闭时抛出 ConnectionResetError"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.tls_sock.recv_into(view[received:], size - received)
+            if not count:
+                raise ConnectionResetError("服务器已关闭连接")
+            received += count
+        return buffer
 
     def recv(self) -> str:
         # 接收数据
         if self.tls_sock:
-            size = int.from_bytes(self.tls_sock.recv(4), 'big')
-            return self.tls_sock.recv(size).decode()
+            size = int.from_bytes(self.recv_exact(4), 'big')
+            return self.recv_exact(size).decode()
         raise ConnectionResetError
 
 
+# 幂等命令：重复执行不会改变服务器状态，断线重连后可以安全重发
+IDEMPOTENT_COMMANDS = {'ping', 'add', 'sub', 'help', 'stats', 'user_get', 'user_search', 'user_count', 'user_stats',
+                       'user_sync'}
+
+
+def is_idempotent(message: str) -> bool:
+    command = message.split(None, 1)[0] if message.strip() else ''
+    return command in IDEMPOTENT_COMMANDS
+
+
+class UnixClientSocket(SecureClientSocket):
+    """
+    Unix域套接字连接，用于与服务器同机部署的客户端
+    帧格式与TLS连接相同，不做TLS加密，由套接字文件权限控制访问
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tls_sock = None
+        self.tcp_nodelay = False
+        self.sock = self.create_socket()
+        self.hostname = None
+        self.port = None
+        self.session = None
+        self.context = None
+
+    @staticmethod
+    def create_socket(tcp_nodelay: bool = False) -> socket.socket:
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def connect(self, hostname: str = None, port: int = None, timeout: float = None):
+        # hostname/port 仅为与 SecureClientSocket 接口一致，连接地址由 path 决定
+        self.sock.settimeout(timeout)
+        self.sock.connect(self.path)
+        self.sock.settimeout(None)
+        self.tls_sock = self.sock
+
+    def close(self):
+        if self.tls_sock:
+            self.shutdown()
+            self.tls_sock.close()
+
+    @property
+    def session_reused(self) -> bool:
+        return False
+
+
+class PendingMessage:
+    """等待回复的请求"""
+    __slots__ = ('content', 'timestamp', 'callback', 'event', 'response', 'deadline', 'packet', 'sent', 'error')
+
+    def __init__(self, content: str, callback=None, event: threading.Event = None, deadline: float = None,
+                 packet: dict = None):
+        self.content = content
+        self.timestamp = time.time()
+        self.callback = callback
+        self.event = event
+        self.response = None
+        self.deadline = deadline  # time.monotonic() 时间，None 表示不过期
+        self.packet = packet  # 消息包，发送和重连后重放时编码（带上当时剩余的超时预算）
+        self.sent = False  # 是否已交给连接发送（重连时只重放已发送的请求）
+        self.error = None  # 请求失败的原因（例如断线后非幂等请求不重发）
+
+
 class Client:
-    def __init__(self, ca_cert_path: str = None):
-        self.socket: SecureClientSocket = SecureClientSocket(ca_cert_path)
+    def __init__(self, ca_cert_path: str = None, heartbeat_interval: float = 15.0, heartbeat_timeout: float = 5.0,
+                 max_in_flight: int = 64, auto_reconnect: bool = True, reconnect_delay: float = 0.1,
+                 max_reconnect_delay: float = 5.0, max_reconnect_attempts: int = 20, unix_socket_path: str = None):
+        """
+        :param heartbeat_interval: 连接空闲多久（秒）后发送一次心跳 ping，0 表示不发送心跳
+        :param heartbeat_timeout: 心跳等待 pong 的超时时间（秒），超时即判定连接已断开
+        :param max_in_flight: 最多同时等待回复的请求数，达到上限时 send_message 阻塞等待（背压）
+        :param auto_reconnect: 连接断开后自动重连（指数退避），并重放在途的幂等请求
+        :param reconnect_delay: 首次重连前的等待时间（秒），之后每次翻倍
+        :param max_reconnect_delay: 重连等待时间上限（秒）
+        :param max_reconnect_attempts: 最多重连次数，全部失败后放弃
+        :param unix_socket_path: 通过Unix域套接字连接同机服务器（不使用TLS），此时 socket.connect() 无需地址参数
+        """
+        if unix_socket_path:
+            self.socket: SecureClientSocket = UnixClientSocket(unix_socket_path)
+        else:
+            self.socket: SecureClientSocket = SecureClientSocket(ca_cert_path)
         self.message_send_queue: queue.Queue = queue.Queue()  # (message_id, message_content)
-        self.pending_messages: dict = {}  # message_id -> (content, timestamp, callback, event, response)
+        self.pending_messages: dict[str, PendingMessage] = {}  # message_id -> PendingMessage
         self.response_handlers: queue.Queue = queue.Queue()  # (message_id, response_content)
         self.running = True
         self.lock = threading.Lock()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.last_received = time.monotonic()  # 最近一次收到服务器数据的时间
+        self.connection_alive = True
+        # 在途请求窗口与超时管理：所有截止时间放在一个最小堆里，由单个清理线程统一处理
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.deadline_heap: list[tuple[float, str]] = []  # (deadline, message_id)
+        self.deadline_cond = threading.Condition(self.lock)
+        self.expired_ids: collections.OrderedDict = collections.OrderedDict()  # 最近超时的消息ID，用于识别迟到回复
+        self.expiry_thread = None
+        self.stats = {'timed_out': 0, 'late_replies': 0, 'reconnects': 0, 'replayed': 0}
+        self.subscriptions: dict = {}  # subscription_id -> (target, callback(event_packet))，接收服务器推送的变更事件
+        # 断线重连
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.send_lock = threading.Lock()  # 串行化发送，重连与重放期间阻止新的发送
 
-    def send_message(self, message: str, callback=None, wait_for_reply=True, timeout=30.0):
-        """发送消息并根据参数决定是否等待响应"""
-        message_id = str(uuid.uuid4())[:8]  # 生成消息ID
+    def send_message(self, message: str, callback=None, wait_for_reply=True, timeout=30.0, message_id: str = None,
+                     trace_id: str = None):
+        """
+        发送消息并根据参数决定是否等待响应
+        在途请求达到 max_in_flight 时阻塞等待窗口空出，等待时间计入 timeout
+        :param callback: 异步请求的回调 callback(message_id, content)；请求超时或连接断开时 content 为异常对象
+                         （TimeoutError / ConnectionError）
+        :param trace_id: 追踪ID，服务器开启请求追踪时用它标记本请求的追踪记录，并在回复中带回
+        """
+        start = time.monotonic()
+        if not self.in_flight.acquire(timeout=timeout):  # timeout 为 None 时一直等待
+            raise TimeoutError("在途请求已达上限，等待发送超时")
+
+        message_id = message_id or str(uuid.uuid4())[:8]  # 生成消息ID
 
         # 创建消息包
         message_packet = {
@@ -73,70 +234,275 @@ class Client:
             'content': message,
             'timestamp': time.time()
         }
+        if trace_id:
+            message_packet['trace_id'] = trace_id
 
         # 如果需要同步等待，创建事件对象
         event = threading.Event() if wait_for_reply else None
+        deadline = start + timeout if timeout is not None else None
+        pending = PendingMessage(message, callback, event, deadline, message_packet)
 
         with self.lock:
-            self.pending_messages[message_id] = (message, time.time(), callback, event, None)
+            self.pending_messages[message_id] = pending
+            if deadline is not None:
+                heapq.heappush(self.deadline_heap, (deadline, message_id))
+                # 新截止时间早于清理线程当前等待的时间时唤醒它
+                if self.deadline_heap[0][1] == message_id:
+                    self.deadline_cond.notify()
+        self.ensure_expiry_thread()
 
         # 发送到服务器
-        self.socket.send(json.dumps(message_packet))
+        with self.send_lock:
+            try:
+                self.socket.send(self.encode_packet(pending))
+                pending.sent = True
+            except Exception:
+                if self.auto_reconnect and self.running and is_idempotent(message):
+                    # 连接已断开：幂等请求留在等待列表中，重连后重放
+                    pending.sent = True
+                else:
+                    self.complete_message(message_id)
+                    raise
 
-        # 如果需要同步等待回复
+        # 如果需要同步等待回复（超时由清理线程负责唤醒）
         if wait_for_reply and event:
-            if event.wait(timeout):  # 等待回复或超时
-                with self.lock:
-                    _, _, _, _, response = self.pending_messages.pop(message_id, (None, None, None, None, None))
-                    if response:
-                        return message_id, response['content'], response
-                    else:
-                        return message_id, None, None
-            else:
-                # 超时处理
-                with self.lock:
-                    self.pending_messages.pop(message_id, None)
-                raise TimeoutError(f"消息 {message_id} 等待回复超时")
+            event.wait()
+            response = pending.response
+            if response:
+                return message_id, response['content'], response
+            if pending.error:
+                raise pending.error
+            raise TimeoutError(f"消息 {message_id} 等待回复超时")
 
         return message_id
 
+    def complete_message(self, message_id: str):
+        """从等待列表中移除请求并释放在途窗口，返回被移除的请求（已被移除时返回None）"""
+        with self.lock:
+            pending = self.pending_messages.pop(message_id, None)
+        if pending is not None:
+            self.in_flight.release()
+        return pending
+
+    def ensure_expiry_thread(self):
+        """按需启动超时清理线程"""
+        if self.expiry_thread is None:
+            with self.lock:
+                if self.expiry_thread is None:
+                    self.expiry_thread = threading.Thread(target=self.expire_messages, daemon=True)
+                    self.expiry_thread.start()
+
+    def expire_messages(self):
+        """超时清理线程：等待最早的截止时间，到期的请求统一移除并唤醒等待者"""
+        while self.running:
+            expired = []
+            with self.lock:
+                while self.running and not self.deadline_heap:
+                    self.deadline_cond.wait()
+                now = time.monotonic()
+                while self.deadline_heap and self.deadline_heap[0][0] <= now:
+                    _, message_id = heapq.heappop(self.deadline_heap)
+                    pending = self.pending_messages.pop(message_id, None)
+                    if pending is not None:  # 已收到回复的请求在堆中惰性删除
+                        expired.append((message_id, pending))
+                        self.stats['timed_out'] += 1
+                        self.expired_ids[message_id] = None
+                        if len(self.expired_ids) > 1024:
+                            self.expired_ids.popitem(last=False)
+                if not expired and self.deadline_heap:
+                    self.deadline_cond.wait(self.deadline_heap[0][0] - now)
+            for message_id, pending in expired:
+                self.fail_message(message_id, pending, TimeoutError(f"消息 {message_id} 等待回复超时"))
+
+    def fail_message(self, message_id: str, pending: PendingMessage, error: Exception):
+        """
+        请求失败（超时或连接断开，已从等待列表移除）：释放在途窗口，唤醒同步等待者；
+        异步请求与收到回复时一样通知回调（或放入 response_handlers），内容为异常对象
+        """
+        pending.error = error
+        self.in_flight.release()
+        try:
+            if pending.callback:
+                pending.callback(message_id, error)
+            elif pending.event is None:
+                self.response_handlers.put((message_id, error))
+        except Exception as e:
+            print(f"请求 {message_id} 的失败回调出错: {e}")
+        if pending.event:
+            pending.event.set()
+
+    def fail_pending_messages(self, only_non_idempotent: bool = False):
+        """
+        连接断开时立即唤醒等待中的请求，不必等到超时
+        :param only_non_idempotent: 只让已发送的非幂等请求失败（重连成功后使用，它们可能已在服务器执行，不能重发）
+        """
+        with self.lock:
+            if only_non_idempotent:
+                failed = {message_id: pending for message_id, pending in self.pending_messages.items()
+                          if pending.sent and not is_idempotent(pending.content)}
+            else:
+                failed = dict(self.pending_messages)
+                self.deadline_heap.clear()
+            for message_id in failed:
+                del self.pending_messages[message_id]
+        for message_id, pending in failed.items():
+            self.fail_message(message_id, pending,
+                              ConnectionError(f"消息 {message_id} 发送后连接已断开，请求可能已执行，未自动重发"))
+
+    @staticmethod
+    def encode_packet(pending: PendingMessage) -> str:
+        """
+        编码消息包，timeout 字段为此刻剩余的等待时间（秒）
+        服务器据此丢弃客户端已经不再等待、或来不及完成的请求；用剩余时间而不是绝对时间，不要求双方时钟一致
+        """
+        if pending.deadline is not None:
+            pending.packet['timeout'] = round(max(pending.deadline - time.monotonic(), 0.0), 3)
+        return json.dumps(pending.packet)
+
+    def replay_pending_messages(self):
+        """重连后重放已发送的幂等请求（调用方持有 send_lock）"""
+        with self.lock:
+            replay = [pending for pending in self.pending_messages.values()
+                      if pending.sent and is_idempotent(pending.content)]
+        for pending in replay:
+            self.socket.send(self.encode_packet(pending))
+        self.stats['replayed'] += len(replay)
+        # 重新订阅，断线期间的变更可能已丢失，通知订阅者重新拉取
+        for subscription_id, (target, callback) in list(self.subscriptions.items()):
+            self.socket.send(json.dumps({'id': subscription_id, 'content': f'user_watch {target}',
+                                         'timestamp': time.time()}))
+            callback({'id': subscription_id, 'event': 'resync', 'content': '连接已恢复，请重新拉取数据'})
+
+    def reconnect(self) -> bool:
+        """指数退避重连，成功后重放幂等请求并让非幂等请求快速失败"""
+        delay = self.reconnect_delay
+        for attempt in range(1, self.max_reconnect_attempts + 1):
+            if not self.running:
+                return False
+            try:
+                with self.send_lock:
+                    self.socket.reconnect()
+                    self.connection_alive = True
+                    self.last_received = time.monotonic()
+                    self.fail_pending_messages(only_non_idempotent=True)
+                    self.replay_pending_messages()
+                self.stats['reconnects'] += 1
+                print(f"已重新连接服务器 (第 {attempt} 次尝试, TLS会话复用: {self.socket.session_reused})")
+                return True
+            except Exception as e:
+                print(f"重连失败 (第 {attempt} 次尝试): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        return False
+
     def handle_responses(self):
         """处理服务器响应的线程"""
         while self.running:
             try:
                 response_data = self.socket.recv()
                 if response_data:
+                    self.last_received = time.monotonic()
                     response_packet = json.loads(response_data)
                     message_id = response_packet.get('id')
                     content = response_packet.get('content')
 
-                    if message_id and message_id in self.pending_messages:
-                        with self.lock:
-                            original_message, timestamp, callback, event, _ = self.pending_messages[message_id]
-                            # 保存响应到pending_messages以便同步获取
-                            self.pending_messages[message_id] = (original_message, timestamp, callback, event,
-                                                                 response_packet)
+                    if 'event' in response_packet:
+                        # 服务器推送的订阅事件
+                        subscription = self.subscriptions.get(message_id)
+                        if subscription:
+                            subscription[1](response_packet)
+                        continue
 
-                        # print(f"收到回复 [ID:{message_id}]: {content}")
-                        # print(f"原始消息: {original_message}")
+                    pending = self.complete_message(message_id) if message_id else None
+                    if pending is not None:
+                        # 保存响应以便同步等待者获取
+                        pending.response = response_packet
 
-                        if callback:
-                            callback(message_id, content)
-                        else:
+                        if pending.callback:
+                            pending.callback(message_id, content)
+                        elif pending.event is None:
                             self.response_handlers.put((message_id, content))
 
                         # 如果是同步等待模式，触发事件
-                        if event:
-                            event.set()
+                        if pending.event:
+                            pending.event.set()
                     elif message_id == 'welcome':
                         pass
+                    elif message_id in self.expired_ids or message_id in self.subscriptions:
+                        # 已超时请求的迟到回复（或重连后重新订阅的回复），计数后丢弃
+                        with self.lock:
+                            self.stats['late_replies'] += 1
                     else:
                         print(f"收到未知或无匹配的消息 [ID:{message_id}]: {content}")
 
+            except Exception as e:
+                if not self.running:
+                    break
+                print(f"响应处理错误: {e}")
+                self.on_connection_lost(e)
+                if not (self.auto_reconnect and self.reconnect()):
+                    self.fail_pending_messages()
+                    break
+
+    def watch(self, target: str = '*', callback=None, timeout=30.0) -> str:
+        """
+        订阅用户变更（user_watch），返回订阅ID
+        :param target: 用户ID、用户名或 '*'（全部用户）
+        :param callback: callback(event_packet)，event_packet['event'] 为 'user_changed' 或 'resync'；
+                         收到 'resync' 表示有事件因积压被丢弃，应重新拉取数据
+        :raises RuntimeError: 服务器拒绝订阅（多worker模式）
+        """
+        subscription_id = str(uuid.uuid4())[:8]
+        # 先登记回调再发送，避免推送事件先于订阅回复到达时被丢弃
+        callback = callback or (lambda packet: print(f"[订阅 {subscription_id}] {packet.get('content')}"))
+        self.subscriptions[subscription_id] = (target, callback)
+        try:
+            _, content, response = self.send_message(f"user_watch {target}", timeout=timeout, message_id=subscription_id)
+        except Exception:
+            self.subscriptions.pop(subscription_id, None)
+            raise
+        if not response.get('data', {}).get('subscribed', True):
+            # 服务器拒绝订阅（例如多worker模式）
+            self.subscriptions.pop(subscription_id, None)
+            raise RuntimeError(content)
+        return subscription_id
+
+    def unwatch(self, subscription_id: str, timeout=30.0):
+        """取消订阅"""
+        self.subscriptions.pop(subscription_id, None)
+        return self.send_message(f"user_unwatch {subscription_id}", timeout=timeout)
+
+    def start_heartbeat(self):
+        """启动心跳线程"""
+        if self.heartbeat_interval > 0:
+            heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+            heartbeat_thread.start()
+
+    def heartbeat(self):
+        """心跳线程：连接空闲超过心跳间隔时发送 ping，等不到 pong 则判定连接已断开"""
+        while self.running:
+            idle = time.monotonic() - self.last_received
+            if idle < self.heartbeat_interval or not self.connection_alive:
+                time.sleep(max(self.heartbeat_interval - idle, 0.1))
+                continue
+            try:
+                self.send_message('ping', timeout=self.heartbeat_timeout)
+                self.last_received = time.monotonic()
             except Exception as e:
                 if self.running:
-                    print(f"响应处理错误: {e}")
-                break
+                    self.on_connection_lost(e)
+                if not self.auto_reconnect:
+                    break
+
+    def on_connection_lost(self, reason):
+        """连接失效处理：关闭套接字，唤醒阻塞在 recv 中的响应处理线程，由它负责重连或退出"""
+        if not self.connection_alive:
+            return
+        self.connection_alive = False
+        print(f"与服务器的连接已断开: {reason}")
+        self.socket.close()
+        # 非幂等请求立即失败；开启自动重连时幂等请求保留，重连后重放
+        self.fail_pending_messages(only_non_idempotent=self.auto_reconnect)
 
     def run(self):
         try:
@@ -145,6 +511,7 @@ class Client:
             response_thread = threading.Thread(target=self.handle_responses)
             response_thread.daemon = True
             response_thread.start()
+            self.start_heartbeat()
 
             print("客户端已连接，请输入消息 (输入 'bye' 退出):")
 
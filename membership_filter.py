@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户名的布隆过滤器
+用于在访问数据库之前判断用户名“不存在”：过滤器说存在时可能误判（误判率由容量和位数决定），此时再查数据库。
+写操作在提交之前把名字加入过滤器，不会漏判。NameFilter 的位数组属于单个进程，其他进程写入的名字要等下一次增量追加
+才会加入；预派生（pre-fork）的多个worker使用 SharedNameFilter，位数组在fork之前分配在共享内存中，
+任何worker写入的名字对所有worker立即可见。其他服务器写入的名字仍然要等增量追加。
+
+布隆过滤器不支持删除：删除用户后对应的位仍然保留，只会增加误判，由定期重建清除。
+"""
+
+import contextlib
+import hashlib
+import math
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+
+def normalize_key(value: str) -> str:
+    """
+    规范化键：转小写并去掉末尾空格
+    MariaDB 默认排序规则比较时不区分大小写、忽略末尾空格，过滤器必须至少与数据库一样宽松，否则会漏判
+    """
+    return value.lower().rstrip(' ')
+
+
+def bloom_size(capacity: int, error_rate: float) -> int:
+    """容纳 capacity 个元素、误判率为 error_rate 所需的位数"""
+    return max(8, int(-max(capacity, 1) * math.log(error_rate) / (math.log(2) ** 2)))
+
+
+class BloomFilter:
+    """按预期元素数和目标误判率确定位数和哈希函数个数的布隆过滤器（双重哈希）"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01, bits=None, lock=None):
+        """
+        :param capacity: 预期元素数，超出后误判率会上升
+        :param error_rate: 元素数达到 capacity 时的目标误判率
+        :param bits: 外部提供的位数组（如共享内存），长度须为 (bloom_size(capacity, error_rate) + 7) // 8；None 表示新分配
+        :param lock: 保护置位的锁，位数组跨进程共享时须使用进程间的锁
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = bloom_size(self.capacity, error_rate)  # 位数
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.lock = lock or threading.Lock()
+
+    def positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        """加入一个键；所有位都已置位（已存在或重复加入）时不计数，count 为近似的不同元素数"""
+        positions = self.positions(key)
+        with self.lock:
+            added = False
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not self.bits[position >> 3] & mask:
+                    self.bits[position >> 3] |= mask
+                    added = True
+            if added:
+                self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def clear(self):
+        with self.lock:
+            self.bits[:] = bytes(len(self.bits))
+            self.count = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def fill_ratio(self) -> float:
+        return int.from_bytes(self.bits, 'little').bit_count() / self.size
+
+    def estimated_error_rate(self) -> float:
+        """按当前置位比例估算的误判率"""
+        return self.fill_ratio() ** self.hash_count
+
+    def estimated_count(self) -> int:
+        """按置位比例估算的元素数（位数组被其他进程写入时 count 不准确）"""
+        fill = self.fill_ratio()
+        if fill >= 1.0:
+            return self.size
+        return round(-self.size / self.hash_count * math.log(1.0 - fill))
+
+
+class NameFilter:
+    """
+    用户名的存在性过滤器：流式扫描全部用户构建，创建/改名时增量加入，定期整体重建（清除已删除的名字）
+    重建期间新增的名字同时加入新旧两个过滤器，重建完成后整体替换；
+    重建开始时仍在进行的写操作的名字（可能只加入了旧过滤器、在扫描之后才提交）也补入新过滤器
+    """
+
+    def __init__(self, error_rate: float = 0.01, headroom: float = 2.0, min_capacity: int = 10000):
+        """
+        :param error_rate: 目标误判率
+        :param headroom: 容量相对当前用户数的倍数，留出增长空间；新增数超过容量时提前重建
+        :param min_capacity: 最小容量
+        """
+        self.error_rate = error_rate
+        self.headroom = headroom
+        self.min_capacity = min_capacity
+        self.filter: BloomFilter = None  # None 表示尚未构建完成，此时不做过滤
+        self.building: BloomFilter = None
+        self.rebuilt_at: float = None  # 最近一次重建完成的时刻（time.monotonic），None 表示尚未构建
+        self.writes: dict = {}  # 进行中的写操作 -> 用户名
+        self.lock = threading.Lock()
+        self.lookups = 0           # 查询过滤器的次数
+        self.negatives = 0         # 过滤器判定不存在（省去数据库查询）的次数
+        self.false_positives = 0   # 过滤器判定可能存在、数据库中实际不存在的次数
+        self.rebuilds = 0
+
+    def add(self, username: str):
+        with self.lock:
+            targets = [bloom for bloom in (self.filter, self.building) if bloom is not None]
+        key = normalize_key(username)
+        for bloom in targets:
+            bloom.add(key)
+
+    @contextlib.contextmanager
+    def writing(self, username: str):
+        """写操作期间登记为进行中，并在写入之前把名字加入过滤器"""
+        token = object()
+        with self.lock:
+            self.writes[token] = username
+        self.add(username)
+        try:
+            yield
+        finally:
+            # 结束时再加入一次：写入期间过滤器可能已被替换，而替换方不一定知道这个写操作（如其他进程的重建）
+            self.add(username)
+            with self.lock:
+                del self.writes[token]
+
+    def might_contain_username(self, username: str) -> bool:
+        """过滤器未就绪时返回 True（交给数据库判断）"""
+        bloom = self.filter
+        if bloom is None:
+            return True
+        self.lookups += 1
+        if normalize_key(username) in bloom:
+            return True
+        self.negatives += 1
+        return False
+
+    def record_false_positive(self):
+        if self.filter is not None:
+            self.false_positives += 1
+
+    def needs_rebuild(self) -> bool:
+        bloom = self.filter
+        return bloom is not None and bloom.count > bloom.capacity
+
+    def rebuild_due(self, interval: float) -> bool:
+        """尚未构建、距上次重建已超过 interval 秒，或元素数超过容量时需要重建"""
+        rebuilt_at = self.rebuilt_at
+        return rebuilt_at is None or time.monotonic() - rebuilt_at >= interval or self.needs_rebuild()
+
+    def new_bloom(self, total: int) -> BloomFilter:
+        return BloomFilter(max(int(total * self.headroom), self.min_capacity), self.error_rate)
+
+    def rebuild(self, total: int, batches) -> bool:
+        """
+        重建过滤器
+        :param total: 当前用户数，用于确定容量
+        :param batches: 逐批生成用户名列表的迭代器，流式扫描不会把全表读入内存
+        :return: 是否完成了重建
+        """
+        bloom = self.new_bloom(total)
+        with self.lock:
+            self.building = bloom
+            in_progress = list(self.writes.values())
+        # 之后开始的写操作会同时加入新过滤器，之前开始、尚未结束的在这里补入
+        for username in in_progress:
+            bloom.add(normalize_key(username))
+        try:
+            for batch in batches:
+                for username in batch:
+                    bloom.add(normalize_key(username))
+        except BaseException:
+            with self.lock:
+                self.building = None
+            raise
+        # 先替换再清除 building，期间的写入不会只落在旧过滤器上
+        with self.lock:
+            self.filter = bloom
+            self.building = None
+            self.rebuilds += 1
+            self.rebuilt_at = time.monotonic()
+        return True
+
+    def item_count(self, bloom: BloomFilter) -> int:
+        return bloom.count
+
+    def stats(self) -> dict:
+        bloom = self.filter
+        if bloom is None:
+            return {'name_filter_ready': False}
+        return {
+            'name_filter_ready': True,
+            'name_filter_items': self.item_count(bloom),
+            'name_filter_capacity': bloom.capacity,
+            'name_filter_memory_bytes': bloom.memory_bytes,
+            'name_filter_hash_count': bloom.hash_count,
+            'name_filter_estimated_fp_rate': round(bloom.estimated_error_rate(), 6),
+            'name_filter_lookups': self.lookups,
+            'name_filter_negatives': self.negatives,
+            'name_filter_false_positives': self.false_positives,
+            # 实测误判率：查询不存在的用户名时，过滤器未能拦下的比例
+            'name_filter_observed_fp_rate': round(self.false_positives / (self.negatives + self.false_positives), 6)
+            if self.false_positives else 0.0,
+            'name_filter_rebuilds': self.rebuilds,
+        }
+
+
+class SharedNameFilter(NameFilter):
+    """
+    多个worker进程共用的用户名过滤器，必须在fork之前创建
+    两个固定容量的位数组和一个状态头分配在匿名共享内存中：一个使用中，另一个供重建时写入，重建完成后切换。
+    置位和状态切换由进程间的锁串行化；同一时间只有一个进程重建，重建时间和切换时间记录在共享状态中。
+
+    其他进程进行中的写操作在重建开始时无法补入新过滤器，由写操作结束时再加入一次补上；
+    切换后 grace 秒内，新过滤器判定不存在的名字再查一次旧过滤器，覆盖“已提交、还没来得及再加入”的短暂窗口。
+    """
+
+    HEADER = struct.Struct('<qqdd')  # 使用中的位数组, 重建中的位数组（-1 表示没有）, 切换时刻, 重建完成时刻
+
+    def __init__(self, capacity: int, error_rate: float = 0.01, grace: float = 2.0):
+        """
+        :param capacity: 固定容量（fork之后无法再分配共享内存，超出后误判率上升，不会漏判）
+        :param grace: 切换后同时参考旧过滤器的时间（秒）
+        """
+        self.grace = grace
+        nbytes = (bloom_size(capacity, error_rate) + 7) // 8
+        self.memory = mmap.mmap(-1, self.HEADER.size + 2 * nbytes)  # 匿名共享映射，fork后父子进程共用
+        self.process_lock = multiprocessing.RLock()  # 置位和状态读写
+        self.rebuild_lock = multiprocessing.Lock()   # 同一时间只有一个进程重建
+        view = memoryview(self.memory)
+        self.blooms = [BloomFilter(capacity, error_rate, view[self.HEADER.size + i * nbytes:
+                                                              self.HEADER.size + (i + 1) * nbytes], self.process_lock)
+                       for i in range(2)]
+        self.HEADER.pack_into(self.memory, 0, -1, -1, 0.0, 0.0)
+        super().__init__(error_rate, min_capacity=capacity)
+
+    def _header(self) -> tuple:
+        return self.HEADER.unpack_from(self.memory, 0)
+
+    def _set_header(self, **values):
+        with self.process_lock:
+            active, building, swapped_at, rebuilt_at = self._header()
+            fields = {'active': active, 'building': building, 'swapped_at': swapped_at, 'rebuilt_at': rebuilt_at}
+            fields.update(values)
+            self.HEADER.pack_into(self.memory, 0, fields['active'], fields['building'], fields['swapped_at'],
+                                  fields['rebuilt_at'])
+
+    def _bloom(self, index: int):
+        return self.blooms[index] if index >= 0 else None
+
+    @property
+    def filter(self) -> BloomFilter:
+        return self._bloom(self._header()[0])
+
+    @filter.setter
+    def filter(self, bloom: BloomFilter):
+        if bloom is None:
+            self._set_header(active=-1)
+        else:
+            self._set_header(active=self.blooms.index(bloom), swapped_at=time.monotonic())
+
+    @property
+    def building(self) -> BloomFilter:
+        return self._bloom(self._header()[1])
+
+    @building.setter
+    def building(self, bloom: BloomFilter):
+        self._set_header(building=-1 if bloom is None else self.blooms.index(bloom))
+
+    @property
+    def rebuilt_at(self) -> float:
+        active, _, _, rebuilt_at = self._header()
+        return rebuilt_at if active >= 0 else None
+
+    @rebuilt_at.setter
+    def rebuilt_at(self, value: float):
+        self._set_header(rebuilt_at=value or 0.0)
+
+    def add(self, username: str):
+        key = normalize_key(username)
+        with self.process_lock:
+            active, building, _, _ = self._header()
+            for index in {active, building} - {-1}:
+                self.blooms[index].add(key)
+
+    def might_contain_username(self, username: str) -> bool:
+        active, _, swapped_at, _ = self._header()
+        if active < 0:
+            return True
+        self.lookups += 1
+        key = normalize_key(username)
+        if key in self.blooms[active]:
+            return True
+        # 刚切换：其他进程进行中的写操作可能只加入了旧过滤器
+        if time.monotonic() - swapped_at < self.grace and key in self.blooms[1 - active]:
+            return True
+        self.negatives += 1
+        return False
+
+    def needs_rebuild(self) -> bool:
+        return False  # 容量固定，重建不能扩容
+
+    def new_bloom(self, total: int) -> BloomFilter:
+        active = self._header()[0]
+        bloom = self.blooms[1 if active == 0 else 0]
+        bloom.clear()
+        return bloom
+
+    def rebuild(self, total: int, batches) -> bool:
+        """其他进程正在重建时直接返回 False"""
+        if not self.rebuild_lock.acquire(block=False):
+            return False
+        try:
+            return super().rebuild(total, batches)
+        finally:
+            self.rebuild_lock.release()
+
+    def item_count(self, bloom: BloomFilter) -> int:
+        return bloom.estimated_count()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['name_filter_shared'] = True
+        return stats
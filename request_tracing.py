@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求级追踪
+每条消息一个 Trace，记录读帧、JSON解析、命令解析、命令处理、数据库调用（含获取连接）、
+回复编码和发送各阶段的耗时。超过阈值的慢请求放入有界环形缓冲区，可通过 trace_dump 命令导出。
+
+当前线程正在处理的 Trace 保存在线程局部变量中：读线程创建后，请求交给数据库通道时
+由工作线程重新 activate。未开启追踪或当前线程没有 Trace 时，span 只做一次属性查找。
+"""
+
+import collections
+import functools
+import threading
+import time
+import uuid
+
+_local = threading.local()
+
+
+class Trace:
+    """一条请求的追踪记录，span 的起点为相对请求开始的秒数"""
+
+    __slots__ = ('trace_id', 'command', 'wall_time', 'start', 'duration', 'spans')
+
+    def __init__(self, trace_id: str = None, start: float = None):
+        self.trace_id = trace_id  # 客户端未传入时，保存为慢请求时再生成
+        self.command = None
+        self.wall_time = time.time()
+        self.start = start if start is not None else time.perf_counter()
+        self.duration = None
+        self.spans: list[tuple[str, float, float]] = []  # (名称, 相对起点, 耗时)
+
+    def add_span(self, name: str, start: float, end: float):
+        self.spans.append((name, start - self.start, end - start))
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'command': self.command,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.wall_time)),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'spans': [{'name': name, 'start_ms': round(offset * 1000, 3), 'duration_ms': round(elapsed * 1000, 3)}
+                      for name, offset, elapsed in sorted(self.spans, key=lambda item: item[1])],
+        }
+
+
+class span:
+    """记录一个阶段的耗时：with span('db.get_user'): ...，当前线程没有 Trace 时不做任何事"""
+
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = getattr(_local, 'trace', None)
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add_span(self.name, self.start, time.perf_counter())
+        return False
+
+
+def traced(name: str):
+    """装饰器：把函数调用记录为一个 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'trace', None) is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace() -> Trace:
+    return getattr(_local, 'trace', None)
+
+
+def activate(trace: Trace):
+    """把 Trace 设为当前线程正在处理的请求（None 表示清除）"""
+    _local.trace = trace
+
+
+class Tracer:
+    """追踪器：创建 Trace，并把慢请求保存到有界环形缓冲区"""
+
+    def __init__(self, slow_threshold: float = 0.1, capacity: int = 100):
+        """
+        :param slow_threshold: 慢请求阈值（秒），总耗时达到阈值的请求才会保存
+        :param capacity: 最多保存的慢请求数，超出时丢弃最早的
+        """
+        self.slow_threshold = slow_threshold
+        self.slow_traces: collections.deque = collections.deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.traced = 0
+        self.slow = 0
+
+    def begin(self, trace_id: str = None, frame_read: float = 0.0) -> Trace:
+        """
+        开始一条请求的追踪
+        :param frame_read: 读帧耗时（收到帧头到读完帧体），作为第一个 span，请求起点前移到收到帧头的时刻
+        """
+        now = time.perf_counter()
+        trace = Trace(trace_id, now - frame_read)
+        trace.spans.append(('frame_read', 0.0, frame_read))
+        return trace
+
+    def finish(self, trace: Trace):
+        trace.duration = time.perf_counter() - trace.start
+        with self.lock:
+            self.traced += 1
+            if trace.duration >= self.slow_threshold:
+                self.slow += 1
+                if trace.trace_id is None:
+                    trace.trace_id = uuid.uuid4().hex[:16]
+                self.slow_traces.append(trace)
+
+    def dump(self, limit: int = None) -> list[dict]:
+        """导出保存的慢请求（最新的在前）"""
+        with self.lock:
+            traces = list(self.slow_traces)
+        traces.reverse()
+        if limit is not None:
+            traces = traces[:limit]
+        return [trace.to_dict() for trace in traces]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'traced_requests': self.traced,
+                'slow_requests': self.slow,
+                'slow_threshold_ms': round(self.slow_threshold * 1000, 3),
+            }
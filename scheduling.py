@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求限流与公平调度
+- TokenBucket / RateLimiter: 按连接、按连接+命令的令牌桶限流，超限时给出建议的重试等待时间
+- FairScheduler: 每个连接一个请求队列，工作线程按连接轮询取任务，
+  单个连接同一时间只执行一个请求（保证该连接的回复顺序），某个连接积压再多也只占一个工作线程
+"""
+
+import collections
+import threading
+import time
+
+
+class TokenBucket:
+    """令牌桶：以 rate 个/秒的速度补充令牌，最多积攒 burst 个"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """尝试取出令牌，成功返回0，失败返回需要等待的秒数（调用方持有锁）"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """按连接和按连接+命令的令牌桶限流"""
+
+    def __init__(self, connection_limit: tuple[float, float] = None,
+                 command_limits: dict[str, tuple[float, float]] = None):
+        """
+        :param connection_limit: 每个连接的 (每秒请求数, 突发上限)，None 表示不限制
+        :param command_limits: 命令名 -> (每秒请求数, 突发上限)，对每个连接单独计数
+        """
+        self.connection_limit = connection_limit
+        self.command_limits = command_limits or {}
+        self.buckets: dict = {}  # (connection_key, command or None) -> TokenBucket
+        self.lock = threading.Lock()
+        self.throttled = 0
+
+    def check(self, connection_key, command: str) -> float:
+        """检查请求是否允许执行：允许返回0，否则返回建议的重试等待时间（秒）"""
+        limits = []
+        if self.connection_limit:
+            limits.append((None, self.connection_limit))
+        if command in self.command_limits:
+            limits.append((command, self.command_limits[command]))
+        if not limits:
+            return 0.0
+        with self.lock:
+            buckets = []
+            for name, (rate, burst) in limits:
+                bucket = self.buckets.get((connection_key, name))
+                if bucket is None:
+                    bucket = self.buckets[(connection_key, name)] = TokenBucket(rate, burst)
+                buckets.append(bucket)
+            # 任一令牌桶不足即拒绝；已取出的令牌退回，避免被拒绝的请求消耗连接配额
+            taken = []
+            for bucket in buckets:
+                retry_after = bucket.try_acquire()
+                if retry_after:
+                    for taken_bucket in taken:
+                        taken_bucket.tokens += 1
+                    self.throttled += 1
+                    return retry_after
+                taken.append(bucket)
+        return 0.0
+
+    def remove_connection(self, connection_key):
+        """连接关闭时清理该连接的令牌桶"""
+        with self.lock:
+            for key in [key for key in self.buckets if key[0] is connection_key]:
+                del self.buckets[key]
+
+
+class FairScheduler:
+    """按连接轮询的公平调度器"""
+
+    def __init__(self, workers: int = 16, max_pending_per_connection: int = 32, max_queued: int = None,
+                 name: str = 'worker'):
+        """
+        :param workers: 工作线程数（共享的处理能力）
+        :param max_pending_per_connection: 每个连接最多排队的请求数，超出时拒绝提交
+        :param max_queued: 所有连接合计最多排队的请求数，None 表示只按连接限制
+        """
+        self.workers = workers
+        self.max_pending_per_connection = max_pending_per_connection
+        self.max_queued = max_queued
+        self.queued = 0
+        self.peak_queued = 0
+        self.cond = threading.Condition()
+        self.queues: dict = {}  # connection_key -> deque[func]
+        self.ready: collections.deque = collections.deque()  # 有待处理任务且当前未在执行的连接，轮询顺序
+        self.running_keys: set = set()
+        self.closed = False
+        self.completed = 0
+        self.threads = [threading.Thread(target=self.worker_loop, name=f'{name}-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, connection_key, func) -> bool:
+        """提交任务到连接的队列，队列已满返回False"""
+        with self.cond:
+            queue = self.queues.get(connection_key)
+            if (queue is not None and len(queue) >= self.max_pending_per_connection) or \
+                    (self.max_queued is not None and self.queued >= self.max_queued):
+                return False
+            if queue is None:
+                queue = self.queues[connection_key] = collections.deque()
+            queue.append(func)
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+            # 连接不在执行中且此前没有排队任务时，加入轮询队列
+            if len(queue) == 1 and connection_key not in self.running_keys:
+                self.ready.append(connection_key)
+                self.cond.notify()
+            return True
+
+    def worker_loop(self):
+        while True:
+            with self.cond:
+                while not self.ready and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                connection_key = self.ready.popleft()
+                func = self.queues[connection_key].popleft()
+                self.queued -= 1
+                self.running_keys.add(connection_key)
+            try:
+                func()
+            except Exception as e:
+                print(f"调度任务执行错误: {e}")
+            with self.cond:
+                self.running_keys.discard(connection_key)
+                self.completed += 1
+                queue = self.queues.get(connection_key)
+                if queue:
+                    # 排到轮询队列末尾，让其他连接先执行
+                    self.ready.append(connection_key)
+                    self.cond.notify()
+                elif queue is not None:
+                    del self.queues[connection_key]
+
+    def remove_connection(self, connection_key):
+        """连接关闭时丢弃该连接尚未执行的任务"""
+        with self.cond:
+            queue = self.queues.pop(connection_key, None)
+            if queue:
+                self.queued -= len(queue)
+            if connection_key in self.ready:
+                self.ready.remove(connection_key)
+
+    def pending(self, connection_key) -> int:
+        """连接排队中（未开始执行）的任务数"""
+        with self.cond:
+            queue = self.queues.get(connection_key)
+            return len(queue) if queue else 0
+
+    def queue_depth(self) -> int:
+        """排队中（未开始执行）的任务数"""
+        return self.queued
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'peak_queued': self.peak_queued,
+                'running': len(self.running_keys),
+                'completed': self.completed,
+            }
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
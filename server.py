@@ -6,22 +6,62 @@
 # @Software: PyCharm
 import json
 import os
+import select
+import signal
 import socket
 import ssl
+import stat
+import sys
 import threading
+import time
 from typing import Any
 
 from command_parser import parse_command
-from database_models import get_db_manager
+from database_models import get_db_manager, reset_db_manager
+from request_tracing import Tracer, activate, current_trace, span
+from scheduling import FairScheduler, RateLimiter
+from subscriptions import SubscriptionHub
+
+# 需要访问数据库的命令，放入数据库通道由专用线程池执行；其余命令（纯内存计算）直接在连接的I/O线程中执行
+DB_COMMANDS = {'user_create', 'user_get', 'user_search', 'user_update', 'user_delete', 'user_count', 'user_stats',
+               'user_sync'}
+
+# 写命令的建议限流配置：每个连接每秒10个、突发上限20，传给 Server(command_rate_limits=...)
+DEFAULT_COMMAND_RATE_LIMITS = {command: (10.0, 20.0) for command in ('user_create', 'user_update', 'user_delete')}
+
+
+def create_listen_socket(hostname: str, port: int, reuse_port: bool = False, backlog: int = 128) -> socket.socket:
+    """创建监听套接字，reuse_port=True 时多个进程可以绑定同一端口，由内核分发连接"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((hostname, port))
+    sock.listen(backlog)
+    return sock
+
+
+def format_user_lines(users) -> str:
+    """
+    把用户列表格式化为每行一个用户的文本
+    直接读取 UserRecord 的属性，不为每行构造中间字典，用一次 join 代替逐行字符串拼接
+    """
+    lines = []
+    for user in users:
+        line = f"  ID: {user.id}, 用户名: {user.username}, 邮箱: {user.email}"
+        if user.full_name:
+            line += f", 姓名: {user.full_name}"
+        if user.age:
+            line += f", 年龄: {user.age}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
 
 
 class SecureServerSocket:
-    def __init__(self, hostname: str, port: int, certfile: str, keyfile: str):
-        # 创建一个普通的 TCP 套接字
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((hostname, port))
-        self.sock.listen(1)
+    def __init__(self, hostname: str, port: int, certfile: str, keyfile: str, reuse_port: bool = False,
+                 sock: socket.socket = None):
+        # 创建一个普通的 TCP 套接字（多进程共享监听套接字时直接使用传入的sock）
+        self.sock = sock if sock is not None else create_listen_socket(hostname, port, reuse_port)
 
         # 检查证书和密钥文件是否存在
         if not os.path.exists(certfile):
@@ -38,50 +78,406 @@ class SecureServerSocket:
         self.sock.close()
 
 
+def create_unix_listen_socket(path: str, mode: int = 0o660, backlog: int = 128) -> socket.socket:
+    """
+    创建Unix域监听套接字，供同机客户端使用（不经过TLS）
+    访问控制依赖套接字文件的权限，mode 默认只允许属主和同组用户连接
+    """
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            # 清理上次运行残留的套接字文件
+            os.unlink(path)
+        else:
+            raise FileExistsError(f"{path} 已存在且不是套接字文件")
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # 在只允许属主访问的 umask 下创建套接字文件，再放宽到 mode，避免 bind 与 chmod 之间按默认权限暴露
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    except OSError:
+        sock.close()
+        raise
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, mode)
+    sock.listen(backlog)
+    return sock
+
+
 class SecureReceivedSocket:
-    def __init__(self, tls_socket: ssl.SSLSocket):
+    """
+    服务器端的一个连接（TLS，或Unix域套接字），帧格式为 4字节大端长度 + UTF-8 数据
+
+    写合并：读线程每读到一帧先 begin_batch()，处理完后 end_batch()——只要还有已经到达的请求（流水线），
+    本批产生的回复（包括期间数据库工作线程和订阅推送产生的帧）都留在输出缓冲区，
+    等没有已到达的请求、缓冲区达到 max_write_bytes、或本批已攒了 max_batch_delay 秒时合并为一次 sendall 写出。
+    数据库工作线程在该连接还有排队请求时以 send(hold=True) 暂存回复，与后续回复一起写出；
+    该连接的队列处理完时由 release() 写出，最迟在暂存 coalesce_delay 秒后由定时器写出（后面的请求执行得再慢也不会拖住）。
+    其余情况下 send() 由当前没有在写的线程直接写出，写的过程中其他线程放入的帧在下一次写时一起写出。
+    写出失败后连接不可再用，之后的 send() 直接抛出该错误。
+    """
+
+    def __init__(self, tls_socket: ssl.SSLSocket, max_write_bytes: int = 64 * 1024, coalesce_delay: float = 0.0,
+                 on_write=None, max_batch_delay: float = 0.005):
+        """
+        :param max_write_bytes: 一次写出最多合并的字节数（单个帧超过时单独写出）
+        :param coalesce_delay: 读线程处理完已到达的请求后再等待后续请求的时间，以及排队请求的回复最长暂存时间（秒）；
+                               0 表示只合并已经到达的请求
+        :param on_write: 每次写出后的回调 on_write(帧数, 字节数)，用于统计
+        :param max_batch_delay: 读线程攒批的最长时间（秒），请求持续到达时也按时写出，不会一直攒下去
+        """
         self.tls_socket = tls_socket
+        self.max_write_bytes = max_write_bytes
+        self.coalesce_delay = coalesce_delay
+        self.max_batch_delay = max(max_batch_delay, coalesce_delay)
+        self.on_write = on_write
+        self.send_lock = threading.Lock()  # 保护输出缓冲区和写出状态
+        self.pending: list[bytes] = []
+        self.pending_bytes = 0
+        self.writing = False
+        self.batching = False  # 读线程正在处理一批已到达的请求，回复暂不写出
+        self.batch_started = 0.0  # 本批开始攒的时刻（time.monotonic）
+        self.held_since = None  # 暂存回复中最早一帧的时刻（time.monotonic），到期由定时器写出
+        self.closed = False
+        self.write_error: Exception = None
+        self.last_frame_read = 0.0  # 最近一帧从收到帧头到读完帧体的耗时（秒），用于请求追踪
+
+    def recv_exact(self, size: int) -> bytes:
+        """读满 size 字节（TLS和TCP都可能一次只返回一部分），对端在中途关闭时抛出 ConnectionResetError"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.tls_socket.recv_into(view[received:], size - received)
+            if not count:
+                raise ConnectionResetError(f"连接在读取帧时关闭 ({received}/{size} 字节)")
+            received += count
+        return buffer
 
     def recv(self) -> str:
         # 接收数据
         raw_size = self.tls_socket.recv(4)
+        if not raw_size:
+            # 对端已关闭连接
+            return ''
+        if len(raw_size) < 4:
+            raw_size += self.recv_exact(4 - len(raw_size))
+        start = time.perf_counter()
         size = int.from_bytes(raw_size, 'big')
         # print(f"接收数据 : {raw_size} bytes")
-        return self.tls_socket.recv(size).decode()
+        data = self.recv_exact(size).decode()
+        self.last_frame_read = time.perf_counter() - start
+        return data
+
+    def input_ready(self, timeout: float = 0.0) -> bool:
+        """是否已有后续请求到达（TLS层已解密的缓冲数据，或内核接收缓冲区中的数据）"""
+        pending = getattr(self.tls_socket, 'pending', None)
+        if pending is not None and pending():
+            return True
+        return bool(select.select([self.tls_socket], [], [], timeout)[0])
+
+    def begin_batch(self):
+        """读线程开始处理一帧：之后产生的回复先留在输出缓冲区"""
+        with self.send_lock:
+            if not self.batching:
+                self.batching = True
+                self.batch_started = time.monotonic()
+
+    def end_batch(self):
+        """读线程处理完一帧：还有已到达的请求、且本批未超过 max_batch_delay 时继续攒批，否则写出本批回复"""
+        if self.closed:
+            return
+        remaining = self.batch_started + self.max_batch_delay - time.monotonic()
+        if remaining > 0 and self.input_ready(min(self.coalesce_delay, remaining)):
+            return
+        with self.send_lock:
+            self.batching = False
+        self.release()
 
-    def send(self, data: str):
-        # 发送数据
-        self.tls_socket.sendall(len(data).to_bytes(4, 'big') + data.encode())
+    def release(self):
+        """写出暂存的回复（读线程在攒批时除外）"""
+        with self.send_lock:
+            self.held_since = None
+            if self.writing or self.batching or not self.pending or self.write_error is not None:
+                return
+            self.writing = True
+        self.flush()
+
+    def release_held(self, since: float):
+        """定时器回调：暂存时刻为 since 的回复到期仍未写出时写出（期间已写出、又开始新一轮暂存的不受影响）"""
+        if self.held_since == since and not self.closed:
+            try:
+                self.release()
+            except OSError as e:
+                print(f"发送暂存回复失败: {e}")
+
+    def send(self, data: str, hold: bool = False):
+        """
+        发送数据：放入输出缓冲区，读线程没有在攒批、也没有其他线程在写时由本线程写出
+        :param hold: 后续还有回复（该连接还有排队请求），暂存不超过 coalesce_delay 秒
+        """
+        payload = data.encode()
+        with self.send_lock:
+            if self.write_error is not None:
+                raise self.write_error
+            self.pending.append(len(payload).to_bytes(4, 'big') + payload)
+            self.pending_bytes += len(self.pending[-1])
+            if self.writing:
+                return
+            now = time.monotonic()
+            if (self.batching and self.pending_bytes < self.max_write_bytes
+                    and now - self.batch_started < self.max_batch_delay):
+                return
+            if hold and self.pending_bytes < self.max_write_bytes:
+                if self.held_since is None:
+                    self.held_since = now
+                    # 到期写出：之后的请求可能执行很久，不能等到它完成再写
+                    timer = threading.Timer(self.coalesce_delay, self.release_held, args=(now,))
+                    timer.daemon = True
+                    timer.start()
+                if now - self.held_since < self.coalesce_delay:
+                    return
+            self.held_since = None
+            self.writing = True
+        self.flush()
+
+    def flush(self):
+        """写出缓冲区中的帧，直到缓冲区为空（只由 writing 标记的持有者调用）"""
+        while True:
+            with self.send_lock:
+                if not self.pending:
+                    self.writing = False
+                    return
+                # 取出不超过 max_write_bytes 的若干帧
+                batch, size = [], 0
+                for frame in self.pending:
+                    if batch and size + len(frame) > self.max_write_bytes:
+                        break
+                    batch.append(frame)
+                    size += len(frame)
+                del self.pending[:len(batch)]
+                self.pending_bytes -= size
+            try:
+                self.tls_socket.sendall(batch[0] if len(batch) == 1 else b''.join(batch))
+            except Exception as e:
+                with self.send_lock:
+                    self.write_error = e
+                    self.pending.clear()
+                    self.pending_bytes = 0
+                    self.writing = False
+                raise
+            if self.on_write:
+                self.on_write(len(batch), size)
 
     def close(self):
-        # 关闭
+        # 关闭前写出缓冲区中剩余的回复（如 bye 的回复）
+        if self.closed:
+            return
+        with self.send_lock:
+            self.batching = False
+            self.held_since = None
+            flush = not self.writing and self.pending and self.write_error is None
+            if flush:
+                self.writing = True
+        if flush:
+            try:
+                self.flush()
+            except OSError:
+                pass
+        self.closed = True
         self.tls_socket.close()
 
 
 class Server:
-    def __init__(self):
-        self.socket = SecureServerSocket('0.0.0.0', 1443, '/root/RemNote/fullchain.crt', '/root/RemNote/dreamcloud.top.pem')
+    def __init__(self, hostname: str = '0.0.0.0', port: int = 1443,
+                 certfile: str = '/root/RemNote/fullchain.crt', keyfile: str = '/root/RemNote/dreamcloud.top.pem',
+                 worker_id: int = 0, reuse_port: bool = False, listen_socket: socket.socket = None,
+                 idle_timeout: float = 300.0, keepalive_idle: int = 60, keepalive_interval: int = 10,
+                 keepalive_count: int = 5, db_workers: int = None, max_pending_per_connection: int = 32,
+                 max_db_queue: int = 1024, unix_socket_path: str = None, unix_socket_mode: int = 0o660,
+                 unix_listen_socket: socket.socket = None,
+                 connection_rate_limit: tuple[float, float] = None,
+                 command_rate_limits: dict[str, tuple[float, float]] = None,
+                 trace_slow_threshold: float = None, trace_buffer_size: int = 100,
+                 tcp_nodelay: bool = True, max_write_bytes: int = 64 * 1024, coalesce_delay: float = 0.0,
+                 handshake_timeout: float = 10.0, max_batch_delay: float = 0.005, workers: int = 1):
+        """
+        :param idle_timeout: 连接空闲读超时（秒），超时未收到任何数据则断开连接，None 表示不超时
+        :param keepalive_idle: TCP keepalive 空闲多久（秒）后开始探测
+        :param keepalive_interval: TCP keepalive 探测间隔（秒）
+        :param keepalive_count: TCP keepalive 连续失败多少次判定连接失效
+        :param db_workers: 数据库通道的工作线程数，所有连接按轮询方式公平共享；默认与主库连接池容量一致
+        :param max_pending_per_connection: 每个连接在数据库通道最多排队的请求数，超出时返回限流回复
+        :param max_db_queue: 数据库通道合计最多排队的请求数
+        :param unix_socket_path: 同时监听的Unix域套接字路径（同机客户端免TLS），None 表示不监听
+        :param unix_socket_mode: Unix域套接字文件权限
+        :param unix_listen_socket: 多进程共享的Unix域监听套接字（由监督进程创建）
+        :param connection_rate_limit: 每个连接的 (每秒请求数, 突发上限)，None（默认）表示不限制，例如 (50.0, 100.0)
+        :param command_rate_limits: 命令名 -> (每秒请求数, 突发上限)，按连接单独计数，None（默认）表示不限制；
+                                    可使用 DEFAULT_COMMAND_RATE_LIMITS 限制写命令
+        :param trace_slow_threshold: 开启请求追踪，总耗时达到该值（秒）的请求保存下来供 trace_dump 导出；None 表示不追踪
+        :param trace_buffer_size: 最多保存的慢请求追踪数
+        :param tcp_nodelay: 是否关闭Nagle算法；回复已在应用层合并写出，小帧不需要再由内核攒批（攒批会和对端的延迟确认叠加出几十毫秒的延迟）
+        :param max_write_bytes: 每个连接一次写出最多合并的字节数
+        :param coalesce_delay: 处理完已到达的请求后再等待后续请求的时间（秒），以延迟换取更多合并；0 表示只合并已经到达的流水线请求、不增加延迟
+        :param handshake_timeout: TLS握手超时（秒），握手在连接线程中进行，超时未完成则断开
+        :param max_batch_delay: 流水线请求持续到达时，一批回复最多攒多久（秒）就写出
+        :param workers: 共同提供服务的worker进程数（由 WorkerSupervisor 传入）；大于1时拒绝 user_watch，
+                        变更事件只在本进程内传播，订阅者会漏掉其他worker处理的写操作
+        """
+        self.socket = SecureServerSocket(hostname, port, certfile, keyfile, reuse_port, listen_socket)
+        self.unix_socket_path = unix_socket_path
+        self.unix_sock = unix_listen_socket
+        if self.unix_sock is None and unix_socket_path:
+            self.unix_sock = create_unix_listen_socket(unix_socket_path, unix_socket_mode)
         self.name = 'server'
+        self.worker_id = worker_id
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.handshake_timeout = handshake_timeout
+        self.tcp_nodelay = tcp_nodelay
+        self.max_write_bytes = max_write_bytes
+        self.coalesce_delay = coalesce_delay
+        self.max_batch_delay = max_batch_delay
         self.db_manager = get_db_manager()  # 初始化数据库管理器
+        # 用户变更订阅（user_watch），写操作成功后由数据库管理器回调推送
+        self.subscriptions = SubscriptionHub()
+        self.db_manager.add_change_listener(self.subscriptions.publish)
+        # 限流（可选）与公平调度：每个连接的请求先经过令牌桶，再进入该连接的队列，由工作线程轮询执行
+        self.rate_limiter = RateLimiter(connection_rate_limit, command_rate_limits)
+        # 数据库通道：线程数与连接池容量一致，避免线程空等连接
+        self.db_lane = FairScheduler(db_workers or self.db_manager.pool_capacity(), max_pending_per_connection,
+                                     max_db_queue, name='db')
+        # 请求追踪（可选）：记录每条消息各阶段耗时，保存慢请求
+        self.tracer = Tracer(trace_slow_threshold, trace_buffer_size) if trace_slow_threshold is not None else None
+        # 本进程（worker）的运行统计
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'connections': 0,         # 累计接受的连接数
+            'active_connections': 0,  # 当前活跃连接数
+            'messages': 0,            # 累计处理的消息数
+            'errors': 0,              # 处理消息出错次数
+            'idle_timeouts': 0,       # 因空闲超时被回收的连接数
+            'queue_full': 0,          # 因连接队列已满被拒绝的请求数
+            'inline_requests': 0,     # 内存通道（I/O线程直接执行）累计请求数
+            'inline_active': 0,       # 内存通道当前正在执行的请求数
+            'writes': 0,              # 写出次数（每次一个 sendall）
+            'frames_written': 0,      # 写出的帧数（回复和推送）
+            'coalesced_writes': 0,    # 合并了多个帧的写出次数
+            'shed_expired': 0,        # 执行前已超过客户端截止时间而丢弃的请求数（不回复）
+            'shed_predicted': 0,      # 预计无法在截止时间内完成而快速失败的请求数
+        }
+        # 命令 -> 执行耗时的指数移动平均（秒），用于预测请求能否在截止时间内完成；读线程和工作线程都会更新
+        self.service_times: dict[str, float] = {}
+        self.service_times_lock = threading.Lock()
+        self.started_at = time.time()
+
+    def incr_stat(self, key: str, delta: int = 1):
+        with self.stats_lock:
+            self.stats[key] += delta
+
+    def record_write(self, frames: int, size: int):
+        """连接写出回调：统计写出次数和每次合并的帧数"""
+        with self.stats_lock:
+            self.stats['writes'] += 1
+            self.stats['frames_written'] += frames
+            if frames > 1:
+                self.stats['coalesced_writes'] += 1
+
+    def new_connection(self, sock) -> SecureReceivedSocket:
+        return SecureReceivedSocket(sock, self.max_write_bytes, self.coalesce_delay, self.record_write,
+                                    self.max_batch_delay)
+
+    def get_stats(self) -> dict[str, Any]:
+        """返回本worker的统计信息"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['worker'] = self.worker_id
+        stats['pid'] = os.getpid()
+        stats['uptime'] = round(time.time() - self.started_at, 1)
+        stats['frames_per_write'] = round(stats['frames_written'] / stats['writes'], 2) if stats['writes'] else 0.0
+        stats.update(self.subscriptions.stats())
+        stats['throttled'] = self.rate_limiter.throttled
+        for key, value in self.db_lane.stats().items():
+            stats[f'db_lane_{key}'] = value
+        if self.tracer:
+            stats.update(self.tracer.stats())
+        if self.db_manager.name_filter:
+            stats.update(self.db_manager.name_filter.stats())
+        return stats
+
+    def configure_connection(self, conn: socket.socket):
+        """为新接受的连接设置TCP keepalive、TCP_NODELAY和空闲读超时，回收半开连接"""
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if self.tcp_nodelay else 0)
+        # 以下选项仅Linux等平台提供
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle)
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keepalive_interval)
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.keepalive_count)
+        conn.settimeout(self.idle_timeout)
+
+    def unix_service_thread(self):
+        """接受Unix域套接字连接：与TLS连接使用相同的帧格式和命令处理，只是不做TLS握手"""
+        try:
+            while True:
+                conn, _ = self.unix_sock.accept()
+                conn.settimeout(self.idle_timeout)
+                self.incr_stat('connections')
+                threading.Thread(target=self.handle_client, args=(self.new_connection(conn),)).start()
+        except Exception as e:
+            print(f"Unix socket server error: {e}")
+        finally:
+            self.unix_sock.close()
 
     def service_thread(self):
         try:
+            if self.unix_sock is not None:
+                print(f"Server listening on unix:{self.unix_sock.getsockname()}")
+                threading.Thread(target=self.unix_service_thread, daemon=True).start()
             print(f"Server listening on {self.socket.sock.getsockname()[0]}:{self.socket.sock.getsockname()[1]}")
             while True:
                 # 接受连接
                 conn, addr = self.socket.sock.accept()
-                print(f"Connection accepted from {addr}")
-                # 使用预先配置好的SSL上下文
-                tls_sock = self.socket.context.wrap_socket(conn, server_side=True)
-                threading.Thread(target=self.handle_client, args=(SecureReceivedSocket(tls_sock),)).start()
+                print(f"[worker {self.worker_id}] Connection accepted from {addr}")
+                try:
+                    self.configure_connection(conn)
+                    # 使用预先配置好的SSL上下文；握手放到连接线程中进行，慢客户端不会阻塞accept循环
+                    tls_sock = self.socket.context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False)
+                except (ssl.SSLError, OSError) as e:
+                    print(f"TLS连接初始化失败 {addr}: {e}")
+                    conn.close()
+                    continue
+                threading.Thread(target=self.handshake_and_handle, args=(tls_sock, addr)).start()
         except Exception as e:
             print(f"Server error: {e}")
         finally:
             # 关闭
             self.socket.close()
 
+    def handshake_and_handle(self, tls_sock: ssl.SSLSocket, addr):
+        """在连接线程中完成TLS握手（限时 handshake_timeout），之后按空闲超时处理该连接"""
+        try:
+            tls_sock.settimeout(self.handshake_timeout)
+            tls_sock.do_handshake()
+            tls_sock.settimeout(self.idle_timeout)
+        except (ssl.SSLError, OSError) as e:
+            print(f"TLS握手失败 {addr}: {e}")
+            tls_sock.close()
+            return
+        self.incr_stat('connections')
+        self.handle_client(self.new_connection(tls_sock))
+
     def handle_client(self, client_socket: SecureReceivedSocket):
         message_id = ""
+        self.incr_stat('active_connections')
         try:
             # 发送欢迎消息（带ID）
             welcome_packet = {
@@ -95,10 +491,17 @@ class Server:
                 data = client_socket.recv()
                 if not data:
                     break
+                received_at = time.monotonic()
+                client_socket.begin_batch()
 
+                trace = None
+                if self.tracer:
+                    trace = self.tracer.begin(frame_read=client_socket.last_frame_read)
+                    activate(trace)
                 try:
                     # 解析JSON格式的消息
-                    message_packet = json.loads(data)
+                    with span('json_decode'):
+                        message_packet = json.loads(data)
                     # print(f"收到客户端消息 [ID:{message_packet.get('id', 'unknown')}]: {message_packet.get('content', '')}")
 
                     # 如果是bye消息（兼容旧格式）
@@ -111,24 +514,57 @@ class Server:
                         client_socket.close()
                         break
 
+                    # 心跳消息直接回复，不经过命令解析和数据库
+                    if isinstance(message_packet, dict) and message_packet.get('content') == 'ping':
+                        client_socket.send(json.dumps({'id': message_packet.get('id', 'unknown'), 'content': 'pong'}))
+                        continue
+
                     # 处理带ID的消息
                     if isinstance(message_packet, dict) and 'content' in message_packet:
                         message_id = message_packet.get('id', 'unknown')
                         content = message_packet['content']
+                        if trace is not None and message_packet.get('trace_id'):
+                            # 客户端传入的追踪ID，用于关联客户端与服务器的日志
+                            trace.trace_id = str(message_packet['trace_id'])
 
                         print(f"收到客户端消息 [ID:{message_id}]: {content}")
+                        self.incr_stat('messages')
 
-                        try:
-                            # 构建回复消息（保持相同的ID以便客户端匹配）
-                            response_packet: dict[str, Any] = self.get_response_message(message_id, content)
-                        except Exception as e:
-                            print(f"处理消息错误: {e}")
-                            response_packet = {
-                                'id': message_id,
-                                'content': f'处理消息错误 {e}'
-                            }
-                        client_socket.send(json.dumps(response_packet))
-                        print(f"发送回复 [ID:{message_id}]: {response_packet['content']}")
+                        command = content.split(None, 1)[0] if isinstance(content, str) and content.strip() else ''
+                        # 截止时间：客户端在 timeout 中给出剩余的等待预算（秒），按本机收到的时刻换算，不依赖双方时钟一致
+                        deadline = None
+                        if isinstance(message_packet.get('timeout'), (int, float)):
+                            deadline = received_at + message_packet['timeout']
+                        # 执行命令解析和数据库操作之前先检查，已过期或来不及完成的请求不再占用处理能力；
+                        # 数据库命令要排在该连接已排队的请求之后执行
+                        shed_reason = self.check_deadline(
+                            command, deadline, self.db_lane.pending(client_socket) if command in DB_COMMANDS else 0)
+                        if shed_reason:
+                            self.shed(client_socket, message_id, shed_reason)
+                            continue
+
+                        # 限流检查，超限直接回复并告知重试等待时间
+                        retry_after = self.rate_limiter.check(client_socket, command)
+                        if retry_after:
+                            self.send_throttled(client_socket, message_id, retry_after)
+                            continue
+
+                        if command not in DB_COMMANDS:
+                            # 内存通道：不访问数据库的命令直接执行，不排在数据库请求之后
+                            self.incr_stat('inline_requests')
+                            self.incr_stat('inline_active')
+                            try:
+                                self.process_message(client_socket, message_id, content, trace, deadline=deadline)
+                            finally:
+                                self.incr_stat('inline_active', -1)
+                        # 数据库通道：放入该连接的队列，由数据库工作线程按连接轮询执行
+                        elif not self.db_lane.submit(client_socket,
+                                                     lambda message_id=message_id, content=content, trace=trace,
+                                                     queued_at=time.perf_counter(), deadline=deadline:
+                                                     self.process_message(client_socket, message_id, content,
+                                                                          trace, queued_at, deadline)):
+                            self.incr_stat('queue_full')
+                            self.send_throttled(client_socket, message_id, 1.0)
 
                     else:
                         # 兼容旧的无ID格式
@@ -143,6 +579,15 @@ class Server:
                         client_socket.close()
                         break
                     client_socket.send(data)
+                finally:
+                    # 读线程不再持有本条消息的追踪（数据库通道的请求由工作线程接着记录）
+                    activate(None)
+                    # 没有已到达的后续请求时写出本批回复
+                    client_socket.end_batch()
+        except socket.timeout:
+            # 空闲超时：客户端长时间无数据（可能已崩溃或网络中断），回收连接
+            print(f"连接空闲超过 {self.idle_timeout} 秒，关闭连接")
+            self.incr_stat('idle_timeouts')
         except ssl.SSLError as e:
             print(f"SSL错误: {e}")
             client_socket.close()
@@ -150,17 +595,133 @@ class Server:
         except Exception as e:
             print(f"客户端处理错误: {e}")
         finally:
+            self.incr_stat('active_connections', -1)
+            self.subscriptions.remove_connection(client_socket)
+            self.db_lane.remove_connection(client_socket)
+            self.rate_limiter.remove_connection(client_socket)
             client_socket.close()
 
-    def get_response_message(self, message_id, content) -> dict[str, Any]:
+    def process_message(self, client_socket: SecureReceivedSocket, message_id, content, trace=None,
+                        queued_at: float = None, deadline: float = None):
+        """
+        在工作线程中处理一条消息并发送回复
+        :param trace: 本条消息的追踪记录（开启追踪时）
+        :param queued_at: 放入数据库通道的时刻（perf_counter），用于记录排队耗时
+        :param deadline: 客户端的截止时间（time.monotonic），None 表示不限
+        """
+        if trace is not None:
+            activate(trace)
+            if queued_at is not None:
+                trace.add_span('queue_wait', queued_at, time.perf_counter())
+        command = content.split(None, 1)[0] if isinstance(content, str) and content.strip() else ''
+        try:
+            if queued_at is not None:
+                # 排队期间可能已经过期，出队时再检查一次
+                shed_reason = self.check_deadline(command, deadline)
+                if shed_reason:
+                    self.shed(client_socket, message_id, shed_reason)
+                    return
+            try:
+                # 构建回复消息（保持相同的ID以便客户端匹配）
+                start = time.perf_counter()
+                with span('command'):
+                    response_packet: dict[str, Any] = self.get_response_message(message_id, content, client_socket)
+                self.record_service_time(command, time.perf_counter() - start)
+            except Exception as e:
+                print(f"处理消息错误: {e}")
+                self.incr_stat('errors')
+                response_packet = {
+                    'id': message_id,
+                    'content': f'处理消息错误 {e}'
+                }
+            if trace is not None and trace.trace_id is not None:
+                response_packet['trace_id'] = trace.trace_id
+            try:
+                with span('encode'):
+                    data = json.dumps(response_packet)
+                with span('send'):
+                    # 数据库通道中该连接还有排队请求时暂存回复，与后续回复合并写出
+                    client_socket.send(data, hold=queued_at is not None and self.coalesce_delay > 0
+                                       and self.db_lane.pending(client_socket) > 0)
+            except OSError as e:
+                print(f"发送回复失败 [ID:{message_id}]: {e}")
+                return
+            print(f"发送回复 [ID:{message_id}]: {response_packet['content']}")
+        finally:
+            if trace is not None:
+                self.tracer.finish(trace)
+                activate(None)
+            if queued_at is not None and not self.db_lane.pending(client_socket):
+                # 该连接的排队请求已处理完，写出暂存的回复（最后一条请求可能被丢弃而没有回复）
+                try:
+                    client_socket.release()
+                except OSError as e:
+                    print(f"发送回复失败: {e}")
+
+    def record_service_time(self, command: str, elapsed: float):
+        """更新命令执行耗时的指数移动平均"""
+        with self.service_times_lock:
+            previous = self.service_times.get(command)
+            self.service_times[command] = elapsed if previous is None else previous + 0.2 * (elapsed - previous)
+
+    def check_deadline(self, command: str, deadline: float, queued_ahead: int = 0) -> str:
+        """
+        检查请求是否还值得执行
+        :param queued_ahead: 该连接排在本请求之前、尚未执行的请求数（同一连接的请求依次执行），按本命令的平均耗时估算等待时间
+        :return: 'expired'（已超过截止时间）/ 'predicted'（按平均耗时和排队请求数已来不及完成）/ None（正常执行）
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return 'expired'
+        with self.service_times_lock:
+            estimate = self.service_times.get(command, 0.0)
+            if estimate * (queued_ahead + 1) <= remaining:
+                return None
+            if estimate > remaining:
+                # 被丢弃的请求不会更新平均耗时，逐步衰减估计值，避免一次偶发的慢请求导致该命令长期被拒绝
+                self.service_times[command] = estimate * 0.9
+        return 'predicted'
+
+    def shed(self, client_socket: SecureReceivedSocket, message_id, reason: str):
+        """丢弃请求：已过期的请求客户端已不再等待，不回复；来不及完成的请求立即回复失败，客户端不必等到超时"""
+        if reason == 'expired':
+            self.incr_stat('shed_expired')
+            return
+        self.incr_stat('shed_predicted')
+        client_socket.send(json.dumps({
+            'id': message_id,
+            'content': '服务器繁忙，请求无法在截止时间内完成，未执行',
+            'shed': True,
+        }))
+
+    def send_throttled(self, client_socket: SecureReceivedSocket, message_id, retry_after: float):
+        """发送限流回复"""
+        retry_after = round(retry_after, 3)
+        client_socket.send(json.dumps({
+            'id': message_id,
+            'content': f'请求过于频繁，请在 {retry_after} 秒后重试',
+            'throttled': True,
+            'retry_after': retry_after,
+        }))
+
+    def get_response_message(self, message_id, content, client_socket: SecureReceivedSocket = None) -> dict[str, Any]:
         """
         根据消息ID和内容生成回复消息
         :param message_id: 消息ID
         :param content: 消息内容
+        :param client_socket: 发送消息的连接（订阅类命令需要）
         :return: 回复消息
         """
         result_content = ""
-        command, args = parse_command(content)
+        result_data = None  # 需要程序化处理的结构化结果（放在回复的 data 字段）
+        with span('parse_command'):
+            command, args = parse_command(content)
+        if self.tracer:
+            trace = current_trace()
+            if trace is not None:
+                trace.command = command
 
         match command:
             case 'add':
@@ -202,7 +763,16 @@ class Server:
                     result_content = "错误: user_create 需要至少3个参数 (username email password)"
 
             case 'user_get':
-                if len(args) >= 1:
+                # user_get [id/username] --fields f1,f2 - 只查询并返回指定字段
+                fields = None
+                if '--fields' in args:
+                    index = args.index('--fields')
+                    fields = args[index + 1].split(',') if index + 1 < len(args) else []
+                    args = args[:index] + args[index + 2:]
+
+                if fields is not None:
+                    result_content = self.get_projected_users_message(args, [field for field in fields if field])
+                elif len(args) >= 1:
                     # user_get [id/username] - 如果参数是数字则按ID查询，否则按用户名查询
                     search_term = args[0]
                     if search_term.isdigit():
@@ -216,14 +786,7 @@ class Server:
                                 # 返回多个用户
                                 users = result['data']
                                 if users:
-                                    result_content = "用户列表:\n"
-                                    for user in users:
-                                        result_content += f"  ID: {user['id']}, 用户名: {user['username']}, 邮箱: {user['email']}"
-                                        if user['full_name']:
-                                            result_content += f", 姓名: {user['full_name']}"
-                                        if user['age']:
-                                            result_content += f", 年龄: {user['age']}"
-                                        result_content += "\n"
+                                    result_content = "用户列表:\n" + format_user_lines(users)
                                 else:
                                     result_content = "没有找到任何用户"
                             else:
@@ -248,19 +811,88 @@ class Server:
                     if result['success'] and 'data' in result:
                         users = result['data']
                         if users:
-                            result_content = "所有用户:\n"
-                            for user in users:
-                                result_content += f"  ID: {user['id']}, 用户名: {user['username']}, 邮箱: {user['email']}"
-                                if user['full_name']:
-                                    result_content += f", 姓名: {user['full_name']}"
-                                if user['age']:
-                                    result_content += f", 年龄: {user['age']}"
-                                result_content += "\n"
+                            result_content = "所有用户:\n" + format_user_lines(users)
                         else:
                             result_content = "数据库中没有用户"
                     else:
                         result_content = "查询失败: " + result.get('message', '未知错误')
 
+            case 'user_count':
+                result = self.db_manager.count_users()
+                if result['success']:
+                    result_content = f"用户总数: {result['data']}"
+                else:
+                    result_content = f"统计失败: {result.get('message', '未知错误')}"
+
+            case 'user_stats':
+                # user_stats [bucket_size] - 年龄分段统计
+                if len(args) >= 1 and not args[0].isdigit():
+                    result_content = "错误: 分段大小必须是正整数"
+                else:
+                    result = self.db_manager.age_stats(int(args[0]) if args else 10)
+                    if result['success']:
+                        stats = result['data']
+                        result_content = f"用户总数: {stats['total']}, 未填写年龄: {stats['unknown_age']}\n"
+                        result_content += f"年龄 最小: {stats['min_age']}, 最大: {stats['max_age']}, 平均: {stats['avg_age']}\n"
+                        result_content += "年龄分布:\n"
+                        for bucket in stats['buckets']:
+                            result_content += f"  {bucket['from']}-{bucket['to']}: {bucket['count']}\n"
+                    else:
+                        result_content = f"统计失败: {result.get('message', '未知错误')}"
+
+            case 'user_search':
+                # user_search keyword [limit] [offset] - 用户名/邮箱前缀匹配 + 姓名/描述分词检索
+                if len(args) >= 1:
+                    try:
+                        limit = min(int(args[1]), 100) if len(args) > 1 else 20
+                        offset = int(args[2]) if len(args) > 2 else 0
+                    except ValueError:
+                        limit = offset = None
+                    if limit is None or limit <= 0 or offset < 0:
+                        result_content = "错误: limit 和 offset 必须是非负整数（limit 大于0）"
+                    else:
+                        result = self.db_manager.search_users(args[0], limit, offset)
+                        if result['success']:
+                            users = result['data']
+                            if users:
+                                result_content = f"搜索结果 (offset {offset}):\n" + format_user_lines(users)
+                                if result['has_more']:
+                                    result_content += f"还有更多结果，下一页: user_search {args[0]} {limit} {offset + limit}"
+                            else:
+                                result_content = "没有匹配的用户"
+                        else:
+                            result_content = f"搜索失败: {result.get('message', '未知错误')}"
+                else:
+                    result_content = "错误: user_search 需要至少1个参数 (keyword [limit] [offset])"
+
+            case 'user_sync':
+                # user_sync [since_token|-] [limit] - 增量同步：只返回令牌之后的变更和删除
+                since_token = args[0] if args and args[0] != '-' else None
+                if len(args) > 1 and not args[1].isdigit():
+                    result_content = "错误: limit 必须是正整数"
+                else:
+                    limit = min(int(args[1]), 500) if len(args) > 1 else 100
+                    result = self.db_manager.sync_users(since_token, max(limit, 1))
+                    if result['success']:
+                        sync = result['data']
+                        result_data = {
+                            'changed': [user.to_dict() for user in sync['changed']],
+                            'deleted': sync['deleted'],
+                            'token': sync['token'],
+                            'has_more': sync['has_more'],
+                        }
+                        result_content = f"增量同步: {result['message']}\n"
+                        if sync['changed']:
+                            result_content += "变更:\n" + format_user_lines(sync['changed'])
+                        if sync['deleted']:
+                            result_content += "删除: " + ", ".join(str(user_id) for user_id in sync['deleted']) + "\n"
+                        if sync['has_more']:
+                            result_content += f"还有更多变更，继续同步: user_sync {sync['token']}"
+                        else:
+                            result_content += f"新令牌: {sync['token']}"
+                    else:
+                        result_content = f"同步失败: {result.get('message', '未知错误')}"
+
             case 'user_update':
                 if len(args) >= 3:
                     # user_update id field1 value1 [field2 value2]...
@@ -314,6 +946,47 @@ class Server:
                 else:
                     result_content = "错误: user_delete 需要1个参数 (用户ID)"
 
+            case 'user_watch':
+                # user_watch [id|username|*] - 订阅用户变更，之后的变更事件以本消息ID推送
+                target = args[0] if args else '*'
+                if self.workers > 1:
+                    # 变更事件不跨进程传播，订阅了也会静默漏掉其他worker的写操作，不如明确拒绝
+                    result_content = "错误: 多worker模式下不支持订阅，变更事件只在单个worker进程内传播"
+                    result_data = {'subscribed': False}
+                elif client_socket is None:
+                    result_content = "错误: 当前连接不支持订阅"
+                    result_data = {'subscribed': False}
+                else:
+                    self.subscriptions.subscribe(client_socket, message_id, target)
+                    result_content = f"订阅成功! 订阅ID: {message_id}, 目标: {target}"
+                    result_data = {'subscribed': True}
+
+            case 'user_unwatch':
+                # user_unwatch subscription_id|* - 取消订阅
+                if len(args) >= 1 and client_socket is not None:
+                    removed = self.subscriptions.unsubscribe(client_socket, args[0])
+                    if removed:
+                        result_content = f"已取消 {removed} 个订阅"
+                    else:
+                        result_content = f"未找到订阅: {args[0]}"
+                else:
+                    result_content = "错误: user_unwatch 需要1个参数 (订阅ID 或 *)"
+
+            case 'stats':
+                # 本worker的运行统计
+                stats = self.get_stats()
+                result_content = "服务器统计:\n" + "\n".join(f"  {key}: {value}" for key, value in stats.items())
+
+            case 'trace_dump':
+                # trace_dump [n] - 导出最近保存的慢请求追踪（JSON）
+                if self.tracer is None:
+                    result_content = "请求追踪未开启（启动服务器时设置 trace_slow_threshold）"
+                elif args and not args[0].isdigit():
+                    result_content = "错误: 数量必须是正整数"
+                else:
+                    traces = self.tracer.dump(int(args[0]) if args else None)
+                    result_content = json.dumps(traces, ensure_ascii=False, indent=2)
+
             case 'help':
                 # 显示帮助信息
                 result_content = """可用命令列表:
@@ -323,11 +996,20 @@ sub num1 num2         - 减法运算
 
 === 数据库操作命令 ===
 user_create username email password [full_name] [age] [description] - 创建用户
-user_get [id/username] - 查询用户（不带参数查询所有用户）
+user_get [id/username] [--fields f1,f2] - 查询用户（不带参数查询所有用户，--fields 只返回指定字段）
+user_count            - 统计用户总数
+user_stats [bucket_size] - 年龄分段统计（默认每10岁一段）
+user_search keyword [limit] [offset] - 搜索用户（用户名/邮箱前缀，姓名/描述关键词）
+user_sync [since_token|-] [limit] - 增量同步（只返回令牌之后的变更和删除，并返回新令牌）
 user_update id field1 value1 [field2 value2]... - 更新用户信息
 user_delete id        - 删除用户
+user_watch [id/username/*] - 订阅用户变更，服务器主动推送变更事件
+user_unwatch subscription_id|* - 取消订阅
 
 === 其他命令 ===
+ping                  - 心跳检测（服务器直接回复 pong）
+stats                 - 查看当前worker的运行统计
+trace_dump [n]        - 导出最近的慢请求追踪（JSON，需开启请求追踪）
 bye                   - 断开连接
 help                  - 显示此帮助信息"""
 
@@ -338,14 +1020,146 @@ help                  - 显示此帮助信息"""
             'id': message_id,
             'content': result_content
         }
+        if result_data is not None:
+            response_packet['data'] = result_data
         return response_packet
 
+    def get_projected_users_message(self, args: list[str], fields: list[str]) -> str:
+        """user_get --fields 的查询与格式化：只输出请求的字段"""
+        if not fields:
+            return "错误: --fields 需要字段列表，例如 --fields id,username"
+        if args:
+            search_term = args[0]
+            if search_term.isdigit():
+                result = self.db_manager.get_user(user_id=int(search_term), fields=fields)
+            else:
+                result = self.db_manager.get_user(username=search_term, fields=fields)
+        else:
+            result = self.db_manager.get_user(fields=fields)
+        if not result['success']:
+            return f"查询失败: {result.get('message', '未知错误')}"
+
+        users = result['data'] if isinstance(result['data'], list) else [result['data']]
+        if not users:
+            return "数据库中没有用户"
+        lines = [", ".join(f"{field}: {user[field]}" for field in user) for user in users]
+        return "用户列表:\n" + "\n".join(f"  {line}" for line in lines)
+
+
+class WorkerSupervisor:
+    """
+    多进程预派生（pre-fork）模式的监督进程
+    每个worker是独立进程（独立GIL），fork之后各自创建数据库引擎；worker异常退出时自动重启
+    """
+
+    def __init__(self, workers: int, restart_delay: float = 1.0, db_kwargs: dict = None, **server_kwargs):
+        """
+        :param db_kwargs: 每个worker在fork之后传给 get_db_manager 的参数（连接串、只读副本、分片、SQLite调优、用户名过滤器等），
+                          None 表示使用默认数据库
+        :param server_kwargs: 传给每个worker的 Server 的参数
+        """
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.db_kwargs = db_kwargs or {}
+        self.server_kwargs = server_kwargs
+        # 建表只在父进程中做一次：多个worker同时建表时SQLite会因数据库被锁定而失败（用户名过滤器只在worker中构建）。
+        # 父进程不启动检查点线程，建完表后释放连接池和线程池：fork时父进程保持单线程，不持有数据库连接
+        manager = get_db_manager(**{**self.db_kwargs, 'name_filter': None}, checkpoint_interval=0)
+        try:
+            # 用户名过滤器的位数组在fork之前分配在共享内存中，一个worker写入的名字其他worker立即可见
+            name_filter = self.db_kwargs.get('name_filter')
+            if name_filter is not None and not name_filter.get('shared'):
+                self.db_kwargs = {**self.db_kwargs, 'name_filter': {**name_filter,
+                                                                    'shared': manager.shared_name_filter(name_filter)}}
+        finally:
+            manager.dispose()
+            reset_db_manager()
+        self.children: dict[int, int] = {}  # pid -> worker_id
+        self.stopping = False
+        self.listen_socket = None
+        # 不支持 SO_REUSEPORT 的平台上由父进程创建监听套接字，fork后由worker共享
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        if not self.reuse_port:
+            self.listen_socket = create_listen_socket(server_kwargs.get('hostname', '0.0.0.0'),
+                                                      server_kwargs.get('port', 1443))
+        # Unix域套接字路径只能绑定一次，由父进程创建后所有worker共享
+        if server_kwargs.get('unix_socket_path'):
+            server_kwargs['unix_listen_socket'] = create_unix_listen_socket(
+                server_kwargs['unix_socket_path'], server_kwargs.get('unix_socket_mode', 0o660))
+
+    def spawn(self, worker_id: int):
+        """fork一个worker进程"""
+        pid = os.fork()
+        if pid == 0:
+            # 子进程：重新创建数据库引擎，不能复用父进程的连接
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                reset_db_manager()
+                get_db_manager(**self.db_kwargs)
+                server = Server(worker_id=worker_id, reuse_port=self.reuse_port, listen_socket=self.listen_socket,
+                                workers=self.workers, **self.server_kwargs)
+                server.service_thread()
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                print(f"[worker {worker_id}] 启动失败: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.children[pid] = worker_id
+        print(f"[supervisor] worker {worker_id} 已启动 (pid={pid})")
+
+    def stop(self, *_):
+        """停止所有worker"""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+        try:
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                worker_id = self.children.pop(pid, None)
+                if worker_id is None:
+                    continue
+                print(f"[supervisor] worker {worker_id} (pid={pid}) 已退出, 状态码 {os.waitstatus_to_exitcode(status)}")
+                if not self.stopping:
+                    # 避免启动即崩溃时疯狂重启
+                    time.sleep(self.restart_delay)
+                    self.spawn(worker_id)
+        except KeyboardInterrupt:
+            self.stop()
+            for pid in list(self.children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            raise
+
 
-def run():
+def run(workers: int = 1, db_kwargs: dict = None):
+    """
+    :param db_kwargs: 传给 get_db_manager 的数据库参数，多worker模式下由每个worker在fork之后使用
+    """
     try:
-        server = Server()
-        print("Starting server on 127.0.0.1:1443...")
-        server.service_thread()
+        if workers > 1:
+            print(f"Starting server on 0.0.0.0:1443 with {workers} workers...")
+            WorkerSupervisor(workers, db_kwargs=db_kwargs).run()
+        else:
+            get_db_manager(**(db_kwargs or {}))
+            server = Server()
+            print("Starting server on 127.0.0.1:1443...")
+            server.service_thread()
     except KeyboardInterrupt:
         print("\nServer stopped.")
     except Exception as e:
@@ -353,4 +1167,5 @@ def run():
 
 
 if __name__ == '__main__':
-    run()
+    # python server.py [worker数量]
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用户变更订阅
+客户端通过 user_watch 订阅用户变更，服务器在创建/更新/删除成功后主动推送事件。
+每个连接有独立的有界事件队列和推送线程，慢速消费者不会阻塞写操作；
+队列积压溢出时丢弃已排队事件并发送 resync 信号，由客户端重新拉取数据。
+"""
+
+import collections
+import json
+import threading
+
+
+ACTION_NAMES = {'create': '创建', 'update': '更新', 'delete': '删除'}
+
+
+class Subscriber:
+    """一个连接上的全部订阅，以及该连接的事件队列和推送线程"""
+
+    def __init__(self, client_socket, max_queue: int = 256):
+        self.client_socket = client_socket
+        self.max_queue = max_queue
+        self.subscriptions: dict[str, str] = {}  # subscription_id -> target ('*' / id / username)
+        self.queue: collections.deque = collections.deque()  # (subscription_id, event_packet)
+        self.resync_pending: set[str] = set()  # 因队列溢出需要发送 resync 的订阅
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.push_loop, daemon=True)
+        self.thread.start()
+
+    def matches(self, target: str, user_data: dict, previous_username: str = None) -> bool:
+        if target == '*':
+            return True
+        if target.isdigit():
+            return user_data['id'] == int(target)
+        return target in (user_data['username'], previous_username)
+
+    def enqueue(self, action: str, user_data: dict, previous_username: str = None):
+        """把事件放入队列（不阻塞调用方），队列已满时丢弃积压事件并标记需要 resync"""
+        with self.cond:
+            if self.closed:
+                return
+            for subscription_id, target in self.subscriptions.items():
+                if not self.matches(target, user_data, previous_username):
+                    continue
+                if len(self.queue) >= self.max_queue:
+                    self.dropped += len(self.queue)
+                    self.resync_pending.update(sub_id for sub_id, _ in self.queue)
+                    self.queue.clear()
+                if subscription_id in self.resync_pending:
+                    # 该订阅已有事件丢失，客户端收到 resync 后会重新拉取，后续事件无需单独排队
+                    self.dropped += 1
+                    continue
+                self.queue.append((subscription_id, {
+                    'id': subscription_id,
+                    'event': 'user_changed',
+                    'action': action,
+                    'data': user_data,
+                    'content': f"用户{ACTION_NAMES.get(action, action)}: ID: {user_data['id']}, "
+                               f"用户名: {user_data['username']}",
+                }))
+            self.cond.notify()
+
+    def push_loop(self):
+        """推送线程：把队列中的事件写到客户端连接"""
+        while True:
+            with self.cond:
+                while not self.closed and not self.queue and not self.resync_pending:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                packets = [{
+                    'id': subscription_id,
+                    'event': 'resync',
+                    'content': '事件积压过多，部分变更已丢弃，请重新拉取数据'
+                } for subscription_id in self.resync_pending if subscription_id in self.subscriptions]
+                self.resync_pending.clear()
+                packets.extend(packet for _, packet in self.queue)
+                self.queue.clear()
+            try:
+                for packet in packets:
+                    self.client_socket.send(json.dumps(packet))
+            except Exception as e:
+                print(f"推送变更事件失败: {e}")
+                self.close()
+                return
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify()
+
+
+class SubscriptionHub:
+    """订阅中心：按连接管理订阅，并接收 DatabaseManager 的变更通知"""
+
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self.subscribers: dict[int, Subscriber] = {}  # id(client_socket) -> Subscriber
+        self.lock = threading.Lock()
+
+    def subscribe(self, client_socket, subscription_id: str, target: str = '*'):
+        with self.lock:
+            subscriber = self.subscribers.get(id(client_socket))
+            if subscriber is None:
+                subscriber = Subscriber(client_socket, self.max_queue)
+                self.subscribers[id(client_socket)] = subscriber
+        with subscriber.cond:
+            subscriber.subscriptions[subscription_id] = target
+
+    def unsubscribe(self, client_socket, subscription_id: str) -> int:
+        """取消订阅，subscription_id 为 '*' 时取消该连接的全部订阅，返回取消的数量"""
+        with self.lock:
+            subscriber = self.subscribers.get(id(client_socket))
+        if subscriber is None:
+            return 0
+        with subscriber.cond:
+            if subscription_id == '*':
+                removed = len(subscriber.subscriptions)
+                subscriber.subscriptions.clear()
+            else:
+                removed = 1 if subscriber.subscriptions.pop(subscription_id, None) is not None else 0
+            empty = not subscriber.subscriptions
+        if empty:
+            self.remove_connection(client_socket)
+        return removed
+
+    def remove_connection(self, client_socket):
+        """连接关闭时清理该连接的全部订阅"""
+        with self.lock:
+            subscriber = self.subscribers.pop(id(client_socket), None)
+        if subscriber is not None:
+            subscriber.close()
+
+    def publish(self, action: str, user_data: dict, previous_username: str = None):
+        """DatabaseManager 变更回调：把事件分发到各订阅连接的队列"""
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        for subscriber in subscribers:
+            subscriber.enqueue(action, user_data, previous_username)
+
+    def stats(self) -> dict:
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        return {
+            'subscriptions': sum(len(s.subscriptions) for s in subscribers),
+            'dropped_events': sum(s.dropped for s in subscribers),
+        }
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Client 的断线检测、重连、超时与订阅测试，连接到在后台线程中运行的 Server（TLS，本机回环）
+
+运行: python -m unittest test_client
+"""
+
+import ssl
+import threading
+import time
+import unittest
+
+from client import Client
+from test_server import ServerTestCase
+
+
+def wait_until(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class ClientTestCase(ServerTestCase):
+    server_kwargs = {}
+
+    def setUp(self):
+        super().setUp()
+        self.clients = []
+        self.make_server(start=True, **self.server_kwargs)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.running = False
+            client.socket.close()
+        super().tearDown()
+
+    def connect(self, **kwargs) -> Client:
+        """连接测试服务器（证书签发给域名，测试中不校验），启动响应处理线程"""
+        kwargs.setdefault('heartbeat_interval', 0)
+        client = Client(**kwargs)
+        client.socket.context.check_hostname = False
+        client.socket.context.verify_mode = ssl.CERT_NONE
+        client.socket.connect('127.0.0.1', self.port, timeout=2.0)
+        threading.Thread(target=client.handle_responses, daemon=True).start()
+        self.clients.append(client)
+        return client
+
+
+class ReconnectTest(ClientTestCase):
+    def test_heartbeat_failure_wakes_reader_and_reconnects(self):
+        client = self.connect()
+        self.assertEqual(client.send_message('add 1 2', timeout=2.0)[1], '计算结果: 3')
+        # 心跳线程判定连接失效时的调用：响应处理线程正阻塞在 recv 中，必须被唤醒才会重连
+        client.on_connection_lost(TimeoutError('心跳超时'))
+        self.assertTrue(wait_until(lambda: client.stats['reconnects'] == 1))
+        self.assertEqual(client.send_message('add 2 3', timeout=2.0)[1], '计算结果: 5')
+
+    def test_forced_drop_resumes_session_and_replays(self):
+        client = self.connect()
+        client.send_message('add 1 2', timeout=2.0)  # 收到回复后客户端才拿到服务器发来的会话票据
+        replies = []
+        get_response_message = self.server.get_response_message
+
+        def slow_count(message_id, content, client_socket=None):
+            if not replies and content == 'user_count':
+                time.sleep(0.2)  # 第一次执行时回复还没发出，连接就被断开
+            return get_response_message(message_id, content, client_socket)
+
+        self.server.get_response_message = slow_count
+        client.send_message('user_count', callback=lambda message_id, content: replies.append(content),
+                            wait_for_reply=False, timeout=5.0)
+        client.on_connection_lost(TimeoutError('心跳超时'))
+        self.assertTrue(wait_until(lambda: replies))
+        self.assertTrue(client.socket.session_reused)
+        self.assertEqual(client.stats['replayed'], 1)
+        self.assertEqual(replies, ['用户总数: 0'])
+
+
+class FailureCallbackTest(ClientTestCase):
+    def slow_server(self, delay: float):
+        get_response_message = self.server.get_response_message
+
+        def slow(message_id, content, client_socket=None):
+            time.sleep(delay)
+            return get_response_message(message_id, content, client_socket)
+
+        self.server.get_response_message = slow
+
+    def test_expired_request_calls_callback_with_timeout(self):
+        client = self.connect(max_in_flight=1)
+        self.slow_server(0.3)
+        results = []
+        client.send_message('user_count', callback=lambda message_id, content: results.append(content),
+                            wait_for_reply=False, timeout=0.05)
+        self.assertTrue(wait_until(lambda: results, timeout=1.0))
+        self.assertIsInstance(results[0], TimeoutError)
+        # 在途窗口已释放，迟到的回复不会再触发回调
+        self.assertTrue(client.in_flight.acquire(timeout=0.1))
+        client.in_flight.release()
+        self.assertTrue(wait_until(lambda: client.stats['late_replies'] == 1))
+        self.assertEqual(len(results), 1)
+
+    def test_connection_loss_calls_callback_with_error(self):
+        client = self.connect(auto_reconnect=False)
+        self.slow_server(0.3)
+        results = []
+        client.send_message('user_create bob bob@example.com secret',
+                            callback=lambda message_id, content: results.append(content), wait_for_reply=False)
+        client.on_connection_lost(TimeoutError('心跳超时'))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], ConnectionError)
+
+
+class MultiWorkerWatchTest(ClientTestCase):
+    server_kwargs = {'workers': 2}
+
+    def test_watch_raises_when_rejected(self):
+        client = self.connect()
+        with self.assertRaises(RuntimeError):
+            client.watch('*', callback=lambda packet: None, timeout=2.0)
+        self.assertEqual(client.subscriptions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
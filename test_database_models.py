@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DatabaseManager 的读写分离、分片、增量同步与用户名过滤器测试
+全部使用临时目录中的SQLite文件：只读副本是一个独立的空库（不做复制），
+从而可以根据能否读到数据判断请求落在主库还是副本上。
+多worker的用户名过滤器测试用 os.fork 模拟另一个worker进程。
+
+运行: python -m unittest test_database_models
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+import warnings
+from unittest import mock
+
+import database_models
+from database_models import Base, DatabaseManager, User, UserDirectory, shard_for_id
+from membership_filter import NameFilter, SharedNameFilter
+from sqlalchemy import create_engine
+
+
+def quiet(func, *args, **kwargs):
+    """DatabaseManager 会打印连接日志，测试中屏蔽"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            for engine in [manager.engine] + [r.engine for r in manager.replicas] + [s.engine for s in manager.shards]:
+                engine.dispose()
+        self.tmp.cleanup()
+
+    def url(self, name: str) -> str:
+        return f"sqlite:///{os.path.join(self.tmp.name, name)}"
+
+    def manager(self, *args, **kwargs) -> DatabaseManager:
+        manager = quiet(DatabaseManager, *args, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def empty_replica(self, name: str = 'replica.db') -> str:
+        """建好表结构的空库，作为不复制数据的只读副本"""
+        url = self.url(name)
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        return url
+
+
+class ReplicaRoutingTest(DatabaseTestCase):
+    def test_reads_go_to_replica(self):
+        manager = self.manager(self.url('primary.db'), [self.empty_replica()])
+        user_id = manager.create_user('alice', 'alice@example.com', 'secret')['data']['id']
+        # 副本是空库：读到数据说明读请求落在了主库
+        self.assertFalse(manager.get_user(user_id=user_id)['success'])
+        self.assertFalse(manager.get_user(username='alice')['success'])
+
+    def test_read_your_writes_window_reads_primary(self):
+        manager = self.manager(self.url('primary.db'), [self.empty_replica()], read_your_writes_window=60.0)
+        user_id = manager.create_user('alice', 'alice@example.com', 'secret')['data']['id']
+        self.assertTrue(manager.get_user(user_id=user_id)['success'])
+        self.assertTrue(manager.get_user(username='alice')['success'])
+        # 写操作同时记录用户列表/统计的键 '*'，统计也读主库
+        self.assertEqual(manager.count_users()['data'], 1)
+
+    def test_failed_replica_falls_back_to_primary(self):
+        missing = self.url(os.path.join('missing-dir', 'replica.db'))
+        manager = self.manager(self.url('primary.db'), [missing])
+        user_id = manager.create_user('alice', 'alice@example.com', 'secret')['data']['id']
+        result = quiet(manager.get_user, user_id=user_id)
+        self.assertTrue(result['success'])
+        self.assertFalse(manager.replicas[0].healthy)
+
+
+class ShardingTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = self.manager(self.url('directory.db'), shard_urls=[self.url('shard0.db'), self.url('shard1.db')])
+
+    def shard_ids(self, index: int) -> set:
+        session = self.db.shards[index].SessionLocal()
+        try:
+            return {row[0] for row in session.query(User.id)}
+        finally:
+            session.close()
+
+    def test_users_are_placed_by_id_hash(self):
+        ids = [self.db.create_user(f'user{i}', f'user{i}@example.com', 'secret')['data']['id'] for i in range(20)]
+        for index in range(2):
+            expected = {user_id for user_id in ids if shard_for_id(user_id, 2) == index}
+            self.assertEqual(self.shard_ids(index), expected)
+        for user_id in ids:
+            self.assertTrue(self.db.get_user(user_id=user_id)['success'])
+        self.assertEqual(self.db.get_user(username='user7')['data']['id'], ids[7])
+
+    def test_username_and_email_unique_across_shards(self):
+        self.db.create_user('alice', 'alice@example.com', 'secret')
+        self.assertFalse(self.db.create_user('alice', 'other@example.com', 'secret')['success'])
+        self.assertFalse(self.db.create_user('bob', 'alice@example.com', 'secret')['success'])
+        session = self.db.get_session()
+        try:
+            self.assertEqual(session.query(UserDirectory).count(), 1)
+        finally:
+            session.close()
+        self.assertEqual(len(self.shard_ids(0) | self.shard_ids(1)), 1)
+
+    def test_failed_rename_restores_directory(self):
+        user_id = self.db.create_user('alice', 'alice@example.com', 'secret')['data']['id']
+        # password 不允许为空，分片写入失败，目录表中的改名必须撤销
+        self.assertFalse(self.db.update_user(user_id, username='alice2', password=None)['success'])
+        self.assertFalse(self.db.get_user(username='alice2')['success'])
+        self.assertEqual(self.db.get_user(username='alice')['data']['id'], user_id)
+        # 旧名字没有被占住，改名仍然可以成功
+        self.assertTrue(self.db.update_user(user_id, username='alice2')['success'])
+        self.assertEqual(self.db.get_user(username='alice2')['data']['username'], 'alice2')
+
+
+class SyncTest(DatabaseTestCase):
+    def test_reused_id_is_not_reported_deleted(self):
+        manager = self.manager(self.url('primary.db'))
+        with mock.patch.object(database_models, 'SYNC_SETTLE_SECONDS', 0):
+            manager.create_user('alice', 'alice@example.com', 'secret')
+            bob_id = manager.create_user('bob', 'bob@example.com', 'secret')['data']['id']
+            time.sleep(0.01)
+            token = manager.sync_users()['data']['token']
+
+            manager.delete_user(bob_id)
+            # SQLite 会重新使用被删除的最大ID
+            carol_id = manager.create_user('carol', 'carol@example.com', 'secret')['data']['id']
+            self.assertEqual(carol_id, bob_id)
+            time.sleep(0.01)
+
+            data = manager.sync_users(token)['data']
+            self.assertEqual([user.username for user in data['changed']], ['carol'])
+            self.assertEqual(data['deleted'], [])
+
+    def test_delete_is_reported(self):
+        manager = self.manager(self.url('primary.db'))
+        with mock.patch.object(database_models, 'SYNC_SETTLE_SECONDS', 0):
+            user_id = manager.create_user('alice', 'alice@example.com', 'secret')['data']['id']
+            time.sleep(0.01)
+            token = manager.sync_users()['data']['token']
+            manager.delete_user(user_id)
+            time.sleep(0.01)
+            data = manager.sync_users(token)['data']
+            self.assertEqual(data['changed'], [])
+            self.assertEqual(data['deleted'], [user_id])
+
+
+class SearchTest(DatabaseTestCase):
+    def test_results_merged_by_id_without_duplicates(self):
+        manager = self.manager(self.url('primary.db'))
+        manager.create_user('bob', 'zed@example.com', 'secret', full_name='Someone Else')
+        manager.create_user('carol', 'bobby@example.com', 'secret')
+        manager.create_user('dave', 'dave@example.com', 'secret', description='works with bob daily')
+        manager.create_user('bobcat', 'cat@example.com', 'secret', full_name='Bob Cat')  # 同时匹配用户名和全文
+        manager.create_user('erin', 'erin@example.com', 'secret')
+
+        result = manager.search_users('bob')
+        self.assertEqual([user['username'] for user in result['data']], ['bob', 'carol', 'dave', 'bobcat'])
+        self.assertFalse(result['has_more'])
+
+        page = manager.search_users('bob', limit=2, offset=1)
+        self.assertEqual([user['username'] for user in page['data']], ['carol', 'dave'])
+        self.assertTrue(page['has_more'])
+
+
+def in_child_process(func):
+    """在fork出的子进程中执行 func（模拟另一个worker），等待其退出并返回退出码"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)  # 测试进程中有后台线程时fork会给出警告
+        pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            quiet(func)
+            code = 0
+        finally:
+            os._exit(code)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class NameFilterTest(DatabaseTestCase):
+    def test_shared_filter_sees_other_process_writes(self):
+        shared = SharedNameFilter(1000)
+        local = NameFilter(min_capacity=1000)
+        for name_filter in (shared, local):
+            name_filter.rebuild(1, [['alice']])
+
+        def create_bob():
+            for name_filter in (shared, local):
+                with name_filter.writing('bob'):
+                    pass
+
+        self.assertEqual(in_child_process(create_bob), 0)
+        self.assertTrue(shared.might_contain_username('Bob'))
+        # 进程私有的过滤器看不到其他进程的写入，要等增量追加
+        self.assertFalse(local.might_contain_username('bob'))
+
+    def test_user_created_by_other_worker_is_found(self):
+        url = self.url('primary.db')
+        options = {'refresh_interval': 3600.0}
+        shared = self.manager(url).shared_name_filter(options)
+        manager = self.manager(url, name_filter={**options, 'shared': shared})
+        self.assertTrue(wait_until(lambda: manager.name_filter.filter is not None))
+
+        def create_bob():
+            DatabaseManager(url, checkpoint_interval=0, name_filter={**options, 'shared': shared}).create_user(
+                'bob', 'bob@example.com', 'secret')
+
+        self.assertEqual(in_child_process(create_bob), 0)
+        # 增量追加要等 refresh_interval，能查到说明另一个worker写入的名字已经在共享的过滤器中
+        self.assertTrue(manager.get_user(username='bob')['success'])
+        self.assertFalse(manager.get_user(username='carol')['success'])
+        self.assertEqual(manager.name_filter.negatives, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Server 的测试：回复写合并的时间上限、限流、按截止时间丢弃请求、多worker下的订阅、监督进程fork前的状态
+连接使用 socketpair，不经过TLS；需要 Server 实例的测试使用临时目录中的SQLite库和仓库中的证书。
+
+运行: python -m unittest test_server
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import database_models
+from server import DEFAULT_COMMAND_RATE_LIMITS, SecureReceivedSocket, Server, WorkerSupervisor
+
+CERT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_frame(sock: socket.socket) -> str:
+    size = int.from_bytes(sock.recv(4, socket.MSG_WAITALL), 'big')
+    return sock.recv(size, socket.MSG_WAITALL).decode()
+
+
+def write_frame(sock: socket.socket, data: str):
+    payload = data.encode()
+    sock.sendall(len(payload).to_bytes(4, 'big') + payload)
+
+
+class ConnectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server_end, self.client_end = socket.socketpair()
+        self.client_end.settimeout(2.0)
+
+    def tearDown(self):
+        self.server_end.close()
+        self.client_end.close()
+
+
+class ServerTestCase(unittest.TestCase):
+    """Server 实例使用临时SQLite库（预先放入全局数据库管理器），服务器和数据库的日志输出在测试期间屏蔽"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.server = None
+        database_models.reset_db_manager()
+        database_models.get_db_manager(f"sqlite:///{os.path.join(self.tmp.name, 'server.db')}")
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.socket.close()
+        database_models.reset_db_manager()
+        self.output.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def make_server(self, start: bool = False, **kwargs) -> Server:
+        """创建监听 127.0.0.1 随机端口的服务器，start 为 True 时在后台线程中接受连接"""
+        self.server = Server('127.0.0.1', 0, os.path.join(CERT_DIR, 'fullchain.crt'),
+                             os.path.join(CERT_DIR, 'dreamcloud.top.pem'), **kwargs)
+        if start:
+            threading.Thread(target=self.server.service_thread, daemon=True).start()
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.socket.sock.getsockname()[1]
+
+
+class CoalescingTest(ConnectionTestCase):
+    def test_held_reply_is_flushed_after_coalesce_delay(self):
+        connection = SecureReceivedSocket(self.server_end, coalesce_delay=0.05)
+        start = time.monotonic()
+        # 暂存后没有任何后续写出（后面的请求一直没完成），定时器到期写出
+        connection.send(json.dumps({'id': '1'}), hold=True)
+        self.assertEqual(json.loads(read_frame(self.client_end))['id'], '1')
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.04)
+        self.assertLess(elapsed, 0.5)
+
+    def test_release_writes_held_reply_immediately(self):
+        connection = SecureReceivedSocket(self.server_end, coalesce_delay=5.0)
+        connection.send('a', hold=True)
+        connection.send('b', hold=True)
+        connection.release()
+        self.assertEqual([read_frame(self.client_end), read_frame(self.client_end)], ['a', 'b'])
+
+    def test_batch_is_flushed_after_max_batch_delay(self):
+        connection = SecureReceivedSocket(self.server_end, max_batch_delay=0.02)
+        connection.begin_batch()
+        connection.send('reply')
+        # 后续请求已经到达，但本批已攒满 max_batch_delay，仍然写出
+        write_frame(self.client_end, 'next request')
+        connection.end_batch()
+        self.client_end.settimeout(0.01)
+        with self.assertRaises(socket.timeout):
+            self.client_end.recv(1, socket.MSG_PEEK)
+        time.sleep(0.03)
+        connection.end_batch()
+        self.client_end.settimeout(2.0)
+        self.assertEqual(read_frame(self.client_end), 'reply')
+
+
+class HandlerTestCase(ServerTestCase):
+    """通过 socketpair 直接驱动 Server.handle_client（不经过TLS和监听套接字）"""
+    server_kwargs = {}
+
+    def setUp(self):
+        super().setUp()
+        self.make_server(**self.server_kwargs)
+        self.server_end, self.client_end = socket.socketpair()
+        self.client_end.settimeout(2.0)
+        self.handler = threading.Thread(target=self.server.handle_client,
+                                        args=(SecureReceivedSocket(self.server_end),), daemon=True)
+        self.handler.start()
+
+    def tearDown(self):
+        self.client_end.close()
+        self.handler.join(2.0)
+        super().tearDown()
+
+    def request(self, message_id: str, content: str, timeout: float = None):
+        packet = {'id': message_id, 'content': content}
+        if timeout is not None:
+            packet['timeout'] = timeout
+        write_frame(self.client_end, json.dumps(packet))
+
+
+class RateLimitTestCase(HandlerTestCase):
+    def send_burst(self, count: int) -> list:
+        """连续发送 count 个 user_create，返回全部回复（限流回复由读线程直接发出，顺序可能与请求不同）"""
+        for i in range(count):
+            self.request(str(i), f'user_create user{i} user{i}@example.com secret')
+        return [json.loads(read_frame(self.client_end)) for _ in range(count)]
+
+
+class DefaultRateLimitTest(RateLimitTestCase):
+    def test_no_limits_by_default(self):
+        replies = self.send_burst(30)
+        self.assertFalse(any(reply.get('throttled') for reply in replies))
+        self.assertEqual(self.server.rate_limiter.throttled, 0)
+
+
+class CommandRateLimitTest(RateLimitTestCase):
+    server_kwargs = {'command_rate_limits': DEFAULT_COMMAND_RATE_LIMITS}
+
+    def test_write_commands_throttled_after_burst(self):
+        replies = self.send_burst(30)
+        throttled = [reply for reply in replies if reply.get('throttled')]
+        # 突发上限20，期间每秒补充10个
+        self.assertGreaterEqual(len(throttled), 8)
+        self.assertLessEqual(len(throttled), 10)
+        self.assertGreater(throttled[0]['retry_after'], 0)
+        # 只限制配置了的命令
+        self.request('sum', 'add 1 2')
+        self.assertEqual(json.loads(read_frame(self.client_end))['content'], '计算结果: 3')
+
+
+class DeadlineTest(HandlerTestCase):
+    def test_expired_request_is_dropped_without_reply(self):
+        self.request('late', 'user_count', timeout=0)
+        self.request('next', 'add 1 2')
+        # 过期的请求不回复，下一帧就是后一个请求的回复
+        self.assertEqual(json.loads(read_frame(self.client_end))['id'], 'next')
+        self.assertEqual(self.server.get_stats()['shed_expired'], 1)
+
+    def test_request_that_cannot_finish_is_rejected(self):
+        self.server.record_service_time('user_count', 5.0)
+        self.request('slow', 'user_count', timeout=1.0)
+        reply = json.loads(read_frame(self.client_end))
+        self.assertEqual(reply['id'], 'slow')
+        self.assertTrue(reply['shed'])
+        self.assertEqual(self.server.get_stats()['shed_predicted'], 1)
+
+    def test_queue_ahead_counts_toward_estimate(self):
+        self.server.record_service_time('user_count', 0.1)
+        deadline = time.monotonic() + 0.25
+        self.assertIsNone(self.server.check_deadline('user_count', deadline))
+        # 前面还有3个排队请求时，预计0.4秒后才能完成
+        self.assertEqual(self.server.check_deadline('user_count', deadline, queued_ahead=3), 'predicted')
+        # 排队导致的丢弃不衰减平均耗时
+        self.assertEqual(self.server.service_times['user_count'], 0.1)
+
+
+class WatchTest(ServerTestCase):
+    def test_watch_rejected_with_multiple_workers(self):
+        server = self.make_server(workers=2)
+        connection = SecureReceivedSocket(socket.socket())
+        response = server.get_response_message('w1', 'user_watch *', connection)
+        self.assertEqual(response['data'], {'subscribed': False})
+        self.assertEqual(server.subscriptions.stats()['subscriptions'], 0)
+        connection.close()
+
+    def test_watch_accepted_with_single_worker(self):
+        server = self.make_server()
+        connection = SecureReceivedSocket(socket.socket())
+        response = server.get_response_message('w1', 'user_watch *', connection)
+        self.assertEqual(response['data'], {'subscribed': True})
+        self.assertEqual(server.subscriptions.stats()['subscriptions'], 1)
+        connection.close()
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database_models.reset_db_manager()
+
+    def tearDown(self):
+        database_models.reset_db_manager()
+        self.tmp.cleanup()
+
+    def test_parent_has_no_threads_or_manager_before_fork(self):
+        threads = threading.active_count()
+        db_kwargs = {'connection_string': f"sqlite:///{os.path.join(self.tmp.name, 'server.db')}", 'name_filter': {}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            supervisor = WorkerSupervisor(2, db_kwargs=db_kwargs)
+        # 建表、分配共享过滤器后父进程不留后台线程（检查点、分片线程池）和全局数据库管理器
+        self.assertEqual(threading.active_count(), threads)
+        self.assertIsNone(database_models._db_manager)
+        self.assertIsNotNone(supervisor.db_kwargs['name_filter']['shared'])
+
+
+if __name__ == '__main__':
+    unittest.main()